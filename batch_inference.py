@@ -0,0 +1,194 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+# Offline batch classifier for directories of field photos. Images are decoded
+# and resized by a parallel tf.data pipeline, preprocessed in batches and run
+# through the cloud SavedModel or a .tflite export in large batches. Results
+# are appended to a CSV or JSON Lines file after every batch, so an interrupted
+# run picks up where it stopped.
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+# The serving backends live with the cloud function
+sys.path.insert(0, os.path.join(PROJECT_ROOT, "cloud"))
+
+def find_images(input_dir):
+    """Relative paths of every image under `input_dir`, sorted"""
+    paths = []
+    for root, _, files in os.walk(input_dir):
+        for f in files:
+            if f.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.relpath(os.path.join(root, f), input_dir))
+    return sorted(paths)
+
+def truncate_partial_line(output_path):
+    """Drop a half-written last line left behind by an interrupted run"""
+    with open(output_path, 'rb+') as f:
+        data = f.read()
+        if data and not data.endswith(b'\n'):
+            f.truncate(data.rfind(b'\n') + 1)
+
+def completed_paths(output_path):
+    """Paths already present in an existing results file"""
+    if not os.path.exists(output_path):
+        return set()
+    truncate_partial_line(output_path)
+    with open(output_path, newline='') as f:
+        if output_path.endswith('.csv'):
+            return {row['path'] for row in csv.DictReader(f)}
+        done = set()
+        for line in f:
+            if line.strip():
+                done.add(json.loads(line)['path'])
+        return done
+
+class ResultWriter:
+    """Append-only CSV or JSON Lines writer, flushed once per batch"""
+
+    def __init__(self, output_path, class_names):
+        self.class_names = class_names
+        self.is_csv = output_path.endswith('.csv')
+        is_new = not os.path.exists(output_path) or os.path.getsize(output_path) == 0
+        self.file = open(output_path, 'a', newline='')
+        if self.is_csv:
+            self.writer = csv.writer(self.file)
+            if is_new:
+                self.writer.writerow(['path', 'class', 'confidence'] + class_names + ['error'])
+
+    def write(self, path, probabilities=None, error=None):
+        if probabilities is None:
+            row = {'path': path, 'error': error}
+            if self.is_csv:
+                self.writer.writerow([path, '', ''] + [''] * len(self.class_names) + [error])
+            else:
+                self.file.write(json.dumps(row) + '\n')
+            return
+
+        top = int(np.argmax(probabilities))
+        if self.is_csv:
+            self.writer.writerow([path, self.class_names[top], f"{probabilities[top]:.6f}"]
+                                 + [f"{p:.6f}" for p in probabilities] + [''])
+        else:
+            self.file.write(json.dumps({
+                'path': path,
+                'class': self.class_names[top],
+                'confidence': float(probabilities[top]),
+                'all_probabilities': {name: float(p) for name, p in zip(self.class_names, probabilities)},
+            }) + '\n')
+
+    def flush(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+def build_pipeline(input_dir, paths, batch_size, target_size, contrast):
+    """tf.data pipeline yielding (paths, float32 batch); undecodable images are dropped"""
+    import tensorflow as tf
+    from graph_preprocess import decode_and_resize, enhance_contrast
+
+    def load(path):
+        image_bytes = tf.io.read_file(tf.strings.join([input_dir, path], separator=os.sep))
+        return path, decode_and_resize(image_bytes, target_size)
+
+    def finish(batch_paths, images):
+        if contrast:
+            images = enhance_contrast(images)
+        return batch_paths, tf.cast(images, tf.float32) / 255.0
+
+    dataset = tf.data.Dataset.from_tensor_slices(paths)
+    dataset = dataset.map(load, num_parallel_calls=tf.data.AUTOTUNE, deterministic=False)
+    dataset = dataset.apply(tf.data.experimental.ignore_errors())
+    dataset = dataset.batch(batch_size)
+    dataset = dataset.map(finish, num_parallel_calls=tf.data.AUTOTUNE)
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
+def load_backend(name, model_dir, tflite_path):
+    from backends import SavedModelBackend, TFLiteBackend
+
+    if name == SavedModelBackend.name:
+        return SavedModelBackend(model_dir)
+    if name == TFLiteBackend.name:
+        return TFLiteBackend(tflite_path, num_threads=os.cpu_count())
+    raise ValueError(f"Unknown model backend '{name}'")
+
+def main(argv=None):
+    """Classify every image under a directory tree"""
+    parser = argparse.ArgumentParser(description='Batch-classify a directory tree of leaf images')
+    parser.add_argument('input_dir', type=str, help='Directory of images (searched recursively)')
+    parser.add_argument('--output', type=str, default='predictions.jsonl',
+                        help='Results file, .csv or .jsonl (default: predictions.jsonl)')
+    parser.add_argument('--backend', choices=['savedmodel', 'tflite'], default='savedmodel',
+                        help='Model format to run (default: savedmodel)')
+    parser.add_argument('--model_dir', type=str, help='SavedModel directory (default: cloud/model)')
+    parser.add_argument('--tflite_path', type=str,
+                        help='.tflite export (default: <model_dir>/tomato_model.tflite)')
+    parser.add_argument('--batch_size', type=int, default=256, help='Inference batch size (default: 256)')
+    parser.add_argument('--no_contrast', action='store_true',
+                        help='Skip the CLAHE contrast enhancement used in training')
+    parser.add_argument('--restart', action='store_true',
+                        help='Discard an existing results file instead of resuming it')
+    args = parser.parse_args(argv)
+
+    model_dir = args.model_dir if args.model_dir else os.path.join(PROJECT_ROOT, "cloud", "model")
+    tflite_path = args.tflite_path if args.tflite_path else os.path.join(model_dir, "tomato_model.tflite")
+    with open(os.path.join(model_dir, 'class_info.json')) as f:
+        class_info = json.load(f)
+    class_names = class_info["classes"]
+    target_size = tuple(class_info.get("input_shape", [96, 96, 3])[:2])
+
+    if args.restart and os.path.exists(args.output):
+        os.remove(args.output)
+    paths = find_images(args.input_dir)
+    done = completed_paths(args.output)
+    pending = [p for p in paths if p not in done]
+    print(f"Found {len(paths)} images, {len(done)} already classified, {len(pending)} to go")
+    if not pending:
+        return 0
+
+    backend = load_backend(args.backend, model_dir, tflite_path)
+    dataset = build_pipeline(os.path.abspath(args.input_dir), pending, args.batch_size,
+                             target_size, not args.no_contrast)
+    writer = ResultWriter(args.output, class_names)
+
+    processed = 0
+    seen = set()
+    start = time.perf_counter()
+    try:
+        for batch_paths, batch in dataset:
+            probabilities = backend.predict(batch.numpy())
+            for path, probs in zip(batch_paths.numpy(), probabilities):
+                path = path.decode()
+                writer.write(path, probs)
+                seen.add(path)
+            writer.flush()
+            processed += len(probabilities)
+            elapsed = time.perf_counter() - start
+            print(f"\rProcessed {processed}/{len(pending)} ({processed / elapsed:.1f} images/sec)", end="")
+        print()
+
+        # Images dropped by the pipeline could not be read or decoded
+        failed = [p for p in pending if p not in seen]
+        for path in failed:
+            writer.write(path, error='could not decode image')
+        writer.flush()
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"Classified {processed} images in {elapsed:.1f}s ({processed / max(elapsed, 1e-9):.1f} images/sec)")
+    if failed:
+        print(f"Warning: {len(failed)} images could not be decoded (recorded with an error)")
+    print(f"Results saved to: {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,279 @@
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Benchmarks for the offline data pipeline hot paths, run against a fixed,
+# seeded synthetic dataset (or a sample of raw_dataset/ with --sample_dir).
+# Everything runs on the CPU without network access: no pretrained weights are
+# downloaded and CUDA devices are hidden before TensorFlow is imported.
+#
+# Each benchmark reports items/sec over several timed repeats (mean, stdev and
+# coefficient of variation) and the peak Python/NumPy allocation per item from a
+# separate tracemalloc pass, so tracing does not skew the timings.
+
+os.environ.setdefault('CUDA_VISIBLE_DEVICES', '-1')
+os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '2')
+
+import cv2
+import numpy as np
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_RESULTS_DIR = os.path.join(PROJECT_ROOT, "benchmark_results")
+CLASSES = ['early_blight_leaf', 'healthy_leaf', 'late_blight_leaf', 'septoria_leaf']
+
+def synthetic_image(rng, height=480, width=640):
+    """Leaf-like test image: smooth colour gradients plus texture noise"""
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    base = np.stack([
+        60 + 40 * np.sin(x / rng.uniform(30, 90)),
+        120 + 60 * np.cos(y / rng.uniform(30, 90)),
+        50 + 30 * np.sin((x + y) / rng.uniform(40, 120)),
+    ], axis=-1)
+    noise = rng.normal(0, 18, size=base.shape)
+    return np.clip(base + noise, 0, 255).astype(np.uint8)
+
+def build_fixtures(root, images_per_class, sample_dir=None, seed=0):
+    """Create raw/, processed/ and data/{train,validation}/ trees under `root`"""
+    import preprocess
+
+    rng = np.random.default_rng(seed)
+    fixtures = {
+        'raw': os.path.join(root, 'raw'),
+        'processed': os.path.join(root, 'processed'),
+        'data': os.path.join(root, 'data'),
+    }
+    for class_name in CLASSES:
+        raw_dir = os.path.join(fixtures['raw'], class_name)
+        os.makedirs(raw_dir)
+        sources = []
+        if sample_dir and os.path.isdir(os.path.join(sample_dir, class_name)):
+            sources = sorted(f for f in os.listdir(os.path.join(sample_dir, class_name))
+                             if f.lower().endswith(('.png', '.jpg', '.jpeg')))[:images_per_class]
+        for i in range(images_per_class):
+            if i < len(sources):
+                shutil.copy(os.path.join(sample_dir, class_name, sources[i]),
+                            os.path.join(raw_dir, f"img_{i}{os.path.splitext(sources[i])[1].lower()}"))
+            else:
+                img = synthetic_image(rng)
+                cv2.imwrite(os.path.join(raw_dir, f"img_{i}.jpg"), cv2.cvtColor(img, cv2.COLOR_RGB2BGR))
+
+        processed_dir = os.path.join(fixtures['processed'], class_name)
+        os.makedirs(processed_dir)
+        for split in ('train', 'validation'):
+            os.makedirs(os.path.join(fixtures['data'], split, class_name))
+        for i, f in enumerate(sorted(os.listdir(raw_dir))):
+            img = preprocess.preprocess_image(os.path.join(raw_dir, f))
+            np.save(os.path.join(processed_dir, os.path.splitext(f)[0] + '.npy'), img)
+            split = 'validation' if i % 5 == 0 else 'train'
+            cv2.imwrite(os.path.join(fixtures['data'], split, class_name, os.path.splitext(f)[0] + '.jpg'),
+                        cv2.cvtColor((img * 255).astype(np.uint8), cv2.COLOR_RGB2BGR))
+    return fixtures
+
+def raw_image_paths(fixtures):
+    return [os.path.join(fixtures['raw'], c, f) for c in CLASSES
+            for f in sorted(os.listdir(os.path.join(fixtures['raw'], c)))]
+
+# Each benchmark takes the fixtures and returns (run, items): `run` performs one
+# timed repeat and `items` is how many images it handles.
+
+def bench_preprocess_image(fixtures):
+    import preprocess
+    paths = raw_image_paths(fixtures)
+
+    def run():
+        for path in paths:
+            preprocess.preprocess_image(path)
+    return run, len(paths)
+
+def bench_prepare_preprocess_image(fixtures):
+    import prepare_dataset
+    paths = raw_image_paths(fixtures)
+
+    def run():
+        for path in paths:
+            prepare_dataset.preprocess_image(path)
+    return run, len(paths)
+
+def bench_augment_dataset(fixtures):
+    import augment_dataset
+    # A single class keeps this benchmark short; the loop is per image anyway
+    input_dir = fixtures['raw'] + '_augment'
+    if not os.path.exists(input_dir):
+        os.makedirs(input_dir)
+        shutil.copytree(os.path.join(fixtures['raw'], CLASSES[0]), os.path.join(input_dir, CLASSES[0]))
+    output_dir = os.path.join(os.path.dirname(fixtures['raw']), 'augmented')
+    items = len(os.listdir(os.path.join(input_dir, CLASSES[0])))
+
+    def run():
+        augment_dataset.augment_dataset(input_dir, output_dir, samples_per_image=2)
+    return run, items
+
+def bench_load_preprocessed_data(fixtures):
+    import train_model
+    items = sum(len(os.listdir(os.path.join(fixtures['processed'], c))) for c in CLASSES)
+
+    def run():
+        train_model.load_preprocessed_data(fixtures['processed'])
+    return run, items
+
+def bench_tomato_cnn_prepare_dataset(fixtures):
+    import tomato_cnn
+    with contextlib.redirect_stdout(io.StringIO()):
+        train, valid, _ = tomato_cnn.prepare_dataset(fixtures['data'])
+    items = sum(len(os.listdir(os.path.join(fixtures['data'], split, c)))
+                for split in ('train', 'validation') for c in CLASSES)
+
+    def run():
+        for dataset in (train, valid):
+            for _ in dataset:
+                pass
+    return run, items
+
+def bench_preprocess_engine(fixtures):
+    import preprocess_engine
+    from prepare_dataset import plan_split
+    output_root = os.path.join(os.path.dirname(fixtures['raw']), 'engine')
+    with contextlib.redirect_stdout(io.StringIO()):
+        class_names, plan = plan_split(fixtures['raw'], 0.2)
+    entries = list(dict.fromkeys((c, f) for _, c, f in plan))
+
+    def run():
+        # The .npy and train/validation outputs from one decode per image
+        sinks = [preprocess_engine.ArraySink(os.path.join(output_root, 'processed'), class_names),
+                 preprocess_engine.SplitJpegSink(os.path.join(output_root, 'data'), class_names, plan)]
+        preprocess_engine.run_engine(fixtures['raw'], entries, sinks)
+    return run, len(entries)
+
+BENCHMARKS = {
+    'preprocess.preprocess_image': bench_preprocess_image,
+    'prepare_dataset.preprocess_image': bench_prepare_preprocess_image,
+    'augment_dataset.augment_dataset': bench_augment_dataset,
+    'train_model.load_preprocessed_data': bench_load_preprocessed_data,
+    'tomato_cnn.prepare_dataset': bench_tomato_cnn_prepare_dataset,
+    'preprocess_engine.run_engine': bench_preprocess_engine,
+}
+
+def measure(run, items, repeats, warmup):
+    """Time `repeats` runs after `warmup` untimed ones, then trace allocations once"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(warmup):
+            run()
+        durations = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            run()
+            durations.append(time.perf_counter() - start)
+
+        tracemalloc.start()
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    rates = [items / d for d in durations]
+    mean = statistics.mean(rates)
+    stdev = statistics.stdev(rates) if len(rates) > 1 else 0.0
+    return {
+        'items': items,
+        'repeats': repeats,
+        'ops_per_sec': round(mean, 2),
+        'ops_per_sec_stdev': round(stdev, 2),
+        'cv_percent': round(100 * stdev / mean, 1) if mean else None,
+        'peak_kb_per_item': round(peak / 1024 / items, 1),
+    }
+
+def compare_to_baseline(results, baseline_path, max_regression):
+    """Return a list of regressions larger than `max_regression` percent"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    regressions = []
+    print(f"\nComparison with {baseline_path} ({baseline.get('label')}):")
+    for name, result in results['benchmarks'].items():
+        previous = baseline['benchmarks'].get(name)
+        if not previous:
+            continue
+        for metric, direction in (('ops_per_sec', -1), ('peak_kb_per_item', 1)):
+            before, now = previous.get(metric), result.get(metric)
+            if not before or now is None:
+                continue
+            change = (now - before) / before * 100
+            print(f"  {name:<36}{metric:<18}{before:>10} -> {now:<10}({change:+.1f}%)")
+            # Throughput drops count as regressions only beyond the run-to-run noise
+            noise = max(result.get('cv_percent') or 0, previous.get('cv_percent') or 0) if direction < 0 else 0
+            if change * direction > max(max_regression, 2 * noise):
+                regressions.append(f"{name}: {metric} {before} -> {now} ({change:+.1f}%)")
+    return regressions
+
+def main(argv=None):
+    """Run the benchmarks, save the results and optionally compare with a baseline"""
+    parser = argparse.ArgumentParser(description='Benchmark the offline data pipeline hot paths')
+    parser.add_argument('--only', action='append', default=[], metavar='NAME',
+                        help=f'Run only this benchmark (repeatable): {", ".join(BENCHMARKS)}')
+    parser.add_argument('--images_per_class', type=int, default=25,
+                        help='Images per class in the fixture dataset (default: 25)')
+    parser.add_argument('--sample_dir', type=str,
+                        help='Take fixture images from this raw dataset (e.g. raw_dataset) instead of synthesizing them')
+    parser.add_argument('--repeats', type=int, default=5, help='Timed repeats per benchmark (default: 5)')
+    parser.add_argument('--warmup', type=int, default=1, help='Untimed warm-up runs (default: 1)')
+    parser.add_argument('--label', type=str, default='run', help='Name stored with the results')
+    parser.add_argument('--output', type=str, help='Results JSON (default: benchmark_results/<timestamp>.json)')
+    parser.add_argument('--save_baseline', type=str, help='Also write the results to this baseline file')
+    parser.add_argument('--baseline', type=str, help='Baseline JSON to compare against; exits 1 on regression')
+    parser.add_argument('--max_regression', type=float, default=15.0,
+                        help='Allowed regression in percent when comparing (default: 15)')
+    args = parser.parse_args(argv)
+
+    unknown = [name for name in args.only if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"Unknown benchmark(s): {', '.join(unknown)}")
+    selected = args.only or list(BENCHMARKS)
+
+    results = {
+        'label': args.label,
+        'created': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'images_per_class': args.images_per_class,
+        'sample_dir': args.sample_dir,
+        'cpu_count': os.cpu_count(),
+        'benchmarks': {},
+    }
+    with tempfile.TemporaryDirectory(prefix='pipeline_bench_') as root:
+        print(f"Building fixtures ({args.images_per_class} images per class)...")
+        fixtures = build_fixtures(root, args.images_per_class, args.sample_dir)
+
+        print(f"\n{'benchmark':<36}{'ops/sec':>10}{'stdev':>9}{'cv':>7}{'KB/item':>10}")
+        for name in selected:
+            with contextlib.redirect_stdout(io.StringIO()):
+                run, items = BENCHMARKS[name](fixtures)
+            result = measure(run, items, args.repeats, args.warmup)
+            results['benchmarks'][name] = result
+            print(f"{name:<36}{result['ops_per_sec']:>10.1f}{result['ops_per_sec_stdev']:>9.1f}"
+                  f"{result['cv_percent']:>6.1f}%{result['peak_kb_per_item']:>10.1f}")
+
+    output = args.output or os.path.join(
+        DEFAULT_RESULTS_DIR, datetime.datetime.now().strftime("%Y%m%d_%H%M%S") + ".json")
+    for path in filter(None, (output, args.save_baseline)):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults saved to: {path}")
+
+    if args.baseline:
+        regressions = compare_to_baseline(results, args.baseline, args.max_regression)
+        if regressions:
+            print("\nRegressions beyond the threshold:")
+            for regression in regressions:
+                print(f"- {regression}")
+            return 1
+        print("\nNo regressions beyond the threshold")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,239 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+import sys
+
+import cv2
+import numpy as np
+
+# Calibration-set builder for int8 TFLite conversion. A stratified, seeded
+# sample of data/train (or of the train TFRecord shards) is decoded once and
+# cached as a compact uint8 .npz keyed by the dataset version (a hash of file
+# names, sizes and mtimes), so repeated conversions skip decoding entirely and
+# always calibrate on the same images.
+
+DEFAULT_PER_CLASS = 20
+DEFAULT_SEED = 42
+# Diversity-aware sampling picks from a seeded candidate pool this many times larger
+CANDIDATE_FACTOR = 5
+
+def list_class_images(train_dir):
+    """Sorted class names and the sorted image files of each class"""
+    class_names = sorted(d for d in os.listdir(train_dir) if os.path.isdir(os.path.join(train_dir, d)))
+    files = {c: sorted(f for f in os.listdir(os.path.join(train_dir, c))
+                       if f.lower().endswith(('.png', '.jpg', '.jpeg')))
+             for c in class_names}
+    return class_names, files
+
+def dataset_version(train_dir, class_names, files):
+    """Short hash of every image's path, size and mtime"""
+    digest = hashlib.sha256()
+    for class_name in class_names:
+        for f in files[class_name]:
+            stat = os.stat(os.path.join(train_dir, class_name, f))
+            digest.update(f"{class_name}/{f}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()[:16]
+
+def files_version(paths):
+    """Short hash of each file's name, size and mtime"""
+    digest = hashlib.sha256()
+    for path in paths:
+        stat = os.stat(path)
+        digest.update(f"{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()[:16]
+
+def _cache_file(cache_dir, version, per_class, img_size, seed, diverse):
+    return os.path.join(
+        cache_dir, f"calib_{version}_{img_size[0]}x{img_size[1]}_n{per_class}_s{seed}"
+                   f"{'_diverse' if diverse else ''}.npz")
+
+def load_rgb(path, img_size):
+    img = cv2.imread(path)
+    if img is None:
+        return None
+    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    return cv2.resize(img, img_size, interpolation=cv2.INTER_AREA)
+
+def image_statistics(images):
+    """Per-channel mean and standard deviation, scaled to comparable ranges"""
+    pixels = images.reshape(len(images), -1, 3).astype(np.float32) / 255.0
+    return np.concatenate([pixels.mean(axis=1), pixels.std(axis=1)], axis=1)
+
+def farthest_point_sample(features, count):
+    """Greedy k-center selection: start at the medoid, then repeatedly take the farthest point"""
+    distances = np.linalg.norm(features - features.mean(axis=0), axis=1)
+    chosen = [int(np.argmin(distances))]
+    nearest = np.linalg.norm(features - features[chosen[0]], axis=1)
+    while len(chosen) < min(count, len(features)):
+        next_index = int(np.argmax(nearest))
+        chosen.append(next_index)
+        nearest = np.minimum(nearest, np.linalg.norm(features - features[next_index], axis=1))
+    return chosen
+
+def sample_class(train_dir, class_name, files, per_class, img_size, rng, diverse):
+    """Decode a seeded sample of one class, optionally spread out by colour statistics"""
+    pool_size = per_class * CANDIDATE_FACTOR if diverse else per_class
+    order = rng.permutation(len(files))
+    images, paths = [], []
+    # Walk the seeded order so unreadable files are replaced by the next candidate
+    for i in order:
+        if len(images) == pool_size:
+            break
+        img = load_rgb(os.path.join(train_dir, class_name, files[i]), img_size)
+        if img is None:
+            print(f"Warning: Could not read {os.path.join(class_name, files[i])}, skipping")
+            continue
+        images.append(img)
+        paths.append(f"{class_name}/{files[i]}")
+
+    if diverse:
+        images, paths = spread_out(images, paths, per_class)
+    return images, paths
+
+def spread_out(images, paths, per_class):
+    """Keep the `per_class` candidates farthest apart in colour statistics"""
+    if len(images) <= per_class:
+        return images, paths
+    keep = farthest_point_sample(image_statistics(np.stack(images)), per_class)
+    return [images[i] for i in keep], [paths[i] for i in keep]
+
+def calibration_cache_path(data_dir, per_class=DEFAULT_PER_CLASS, img_size=(96, 96), seed=DEFAULT_SEED,
+                           diverse=False, cache_dir=None):
+    """Cache file for these settings and the current contents of data_dir/train"""
+    train_dir = os.path.join(data_dir, 'train')
+    class_names, files = list_class_images(train_dir)
+    version = dataset_version(train_dir, class_names, files)
+    cache_dir = cache_dir or os.path.join(data_dir, '.calibration')
+    return _cache_file(cache_dir, version, per_class, img_size, seed, diverse)
+
+def save_calibration_set(cache_path, images, labels, paths, class_names):
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp_path = cache_path + '.tmp.npz'
+    np.savez_compressed(tmp_path, images=images, labels=np.array(labels), paths=np.array(paths),
+                        classes=np.array(class_names))
+    os.replace(tmp_path, cache_path)
+    print(f"Calibration set saved to: {cache_path} ({len(images)} images, {images.nbytes / 1024:.0f} KB)")
+
+def build_calibration_set(data_dir, per_class=DEFAULT_PER_CLASS, img_size=(96, 96), seed=DEFAULT_SEED,
+                          diverse=False, cache_dir=None):
+    """Return cached (or freshly built) calibration images as uint8 [N, H, W, 3]"""
+    train_dir = os.path.join(data_dir, 'train')
+    class_names, files = list_class_images(train_dir)
+    cache_path = calibration_cache_path(data_dir, per_class, img_size, seed, diverse, cache_dir)
+
+    if os.path.exists(cache_path):
+        with np.load(cache_path) as cached:
+            print(f"Using cached calibration set: {cache_path}")
+            return cached['images']
+
+    print(f"Building calibration set from {train_dir} ({per_class} per class, seed {seed}"
+          f"{', diversity-aware' if diverse else ''})...")
+    rng = np.random.default_rng(seed)
+    images, labels, paths = [], [], []
+    for class_idx, class_name in enumerate(class_names):
+        class_images, class_paths = sample_class(
+            train_dir, class_name, files[class_name], per_class, img_size, rng, diverse)
+        images.extend(class_images)
+        paths.extend(class_paths)
+        labels.extend([class_idx] * len(class_images))
+    if not images:
+        raise ValueError(f"No readable calibration images found in {train_dir}")
+
+    images = np.stack(images)
+    save_calibration_set(cache_path, images, labels, paths, class_names)
+    return images
+
+def build_record_calibration_set(tfrecord_dir, per_class=DEFAULT_PER_CLASS, seed=DEFAULT_SEED,
+                                 diverse=False, cache_dir=None):
+    """Calibration set drawn from the train TFRecord shards (prepare_dataset.py --format tfrecord)
+
+    The sample is stratified by label like build_calibration_set: a seeded permutation per class, read in
+    two sequential passes (labels, then the chosen pixels). Cached next to the
+    shards, keyed by their names, sizes and mtimes.
+    """
+    import tensorflow as tf
+
+    with open(os.path.join(tfrecord_dir, 'metadata.json')) as f:
+        metadata = json.load(f)
+    class_names = metadata['classes']
+    image_shape = metadata['image_shape']
+    img_size = (image_shape[1], image_shape[0])
+    shards = sorted(glob.glob(os.path.join(tfrecord_dir, "train-*.tfrecord")))
+    if not shards:
+        raise ValueError(f"No train shards found in {tfrecord_dir}")
+    cache_path = _cache_file(cache_dir or os.path.join(tfrecord_dir, '.calibration'),
+                             files_version(shards), per_class, img_size, seed, diverse)
+
+    if os.path.exists(cache_path):
+        with np.load(cache_path) as cached:
+            print(f"Using cached calibration set: {cache_path}")
+            return cached['images']
+
+    print(f"Building calibration set from {len(shards)} train shards ({per_class} per class, seed {seed}"
+          f"{', diversity-aware' if diverse else ''})...")
+    records = tf.data.TFRecordDataset(shards)
+    labels_only = records.batch(1024).map(
+        lambda batch: tf.io.parse_example(batch, {'label': tf.io.FixedLenFeature([], tf.int64)})['label'])
+    record_labels = np.concatenate([labels.numpy() for labels in labels_only])
+
+    # Every record is readable, so each class's seeded order is cut to the pool directly
+    pool_size = per_class * CANDIDATE_FACTOR if diverse else per_class
+    rng = np.random.default_rng(seed)
+    wanted = {}
+    for class_idx in range(len(class_names)):
+        members = np.flatnonzero(record_labels == class_idx)
+        for i in rng.permutation(len(members))[:pool_size]:
+            wanted[int(members[i])] = class_idx
+
+    pixels = {}
+    feature_spec = {'image': tf.io.FixedLenFeature([], tf.string)}
+    for index, record in enumerate(records):
+        if index in wanted:
+            raw = tf.io.parse_single_example(record, feature_spec)['image'].numpy()
+            pixels[index] = np.frombuffer(raw, dtype=np.uint8).reshape(image_shape)
+
+    images, labels, paths = [], [], []
+    for class_idx, class_name in enumerate(class_names):
+        indices = [i for i, label in wanted.items() if label == class_idx]
+        class_images = [pixels[i] for i in indices]
+        class_paths = [f"{class_name}/record-{i}" for i in indices]
+        if diverse:
+            class_images, class_paths = spread_out(class_images, class_paths, per_class)
+        images.extend(class_images)
+        paths.extend(class_paths)
+        labels.extend([class_idx] * len(class_images))
+    if not images:
+        raise ValueError(f"No calibration records found in {tfrecord_dir}")
+
+    images = np.stack(images)
+    save_calibration_set(cache_path, images, labels, paths, class_names)
+    return images
+
+def representative_dataset(images):
+    """Zero-decode generator for TFLiteConverter.representative_dataset"""
+    def gen():
+        for img in images:
+            yield [img[np.newaxis].astype(np.float32) / 255.0]
+    return gen
+
+def main(argv=None):
+    """Build (or refresh) the cached calibration set"""
+    parser = argparse.ArgumentParser(description='Build the cached int8 calibration set from data/train')
+    parser.add_argument('--data_dir', type=str, help='Data directory with a train/ folder (default: data)')
+    parser.add_argument('--per_class', type=int, default=DEFAULT_PER_CLASS,
+                        help=f'Images per class (default: {DEFAULT_PER_CLASS})')
+    parser.add_argument('--img_size', type=int, default=96, help='Square model input size in pixels (default: 96)')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED, help=f'Sampling seed (default: {DEFAULT_SEED})')
+    parser.add_argument('--diverse', action='store_true',
+                        help='Spread the sample out by per-image colour statistics')
+    args = parser.parse_args(argv)
+
+    PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+    data_dir = args.data_dir if args.data_dir else os.path.join(PROJECT_ROOT, "data")
+    build_calibration_set(data_dir, args.per_class, (args.img_size, args.img_size), args.seed, args.diverse)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
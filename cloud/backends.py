@@ -0,0 +1,154 @@
+import numpy as np
+
+# Backends are imported lazily so the TFLite path never pulls in full TensorFlow
+# when tflite_runtime is installed.
+
+def scale_into(pixels, out):
+    """Write uint8 pixels into a float32 buffer, scaled to [0, 1]"""
+    np.multiply(pixels, np.float32(1.0 / 255.0), out=out)
+
+class InvalidImageError(ValueError):
+    """The model could not decode one of the encoded images it was given"""
+
+class SavedModelBackend:
+    """Serve the exported SavedModel through its serving signature"""
+    name = 'savedmodel'
+
+    def __init__(self, model_dir, intra_op_threads=None, inter_op_threads=None):
+        import tensorflow as tf
+        self._tf = tf
+
+        # Thread pools are process-wide and can only be configured before the
+        # runtime starts; unset counts keep TensorFlow's defaults
+        try:
+            if intra_op_threads:
+                tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+            if inter_op_threads:
+                tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+        except RuntimeError as e:
+            print(f"Could not set TensorFlow thread counts: {str(e)}")
+
+        # Load the model and resolve its serving signature
+        self.model = tf.saved_model.load(model_dir)
+        if "serve" in self.model.signatures:
+            self.model_func = self.model.signatures["serve"]
+        else:
+            self.model_func = self.model.signatures["serving_default"]
+
+        # Signatures only accept keyword arguments, so remember the input name
+        _, input_spec = self.model_func.structured_input_signature
+        self.input_name = next(iter(input_spec))
+
+        # Models exported by train_model.save_for_cloud can also take encoded
+        # image bytes and preprocess them in the graph
+        self.bytes_func = None
+        if "serve_bytes" in self.model.signatures:
+            self.bytes_func = self.model.signatures["serve_bytes"]
+            _, bytes_spec = self.bytes_func.structured_input_signature
+            self.bytes_input_name = next(iter(bytes_spec))
+
+    def predict(self, batch):
+        """Run a float32 NHWC batch and return the probabilities as numpy"""
+        predictions = self.model_func(**{self.input_name: self._tf.constant(batch)})
+        if isinstance(predictions, dict):
+            predictions = predictions[next(iter(predictions))]
+        return predictions.numpy()
+
+    def predict_bytes(self, encoded_images):
+        """Run a list of encoded images through the in-graph preprocessing signature"""
+        try:
+            predictions = self.bytes_func(**{self.bytes_input_name: self._tf.constant(encoded_images)})
+        except self._tf.errors.InvalidArgumentError as e:
+            # Raised by the in-graph decoder for bytes that are not a (complete) image
+            raise InvalidImageError(e.message) from e
+        if isinstance(predictions, dict):
+            predictions = predictions[next(iter(predictions))]
+        return predictions.numpy()
+
+def _load_interpreter_class():
+    """Prefer the standalone tflite_runtime package over full TensorFlow"""
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        import tensorflow as tf
+        Interpreter = tf.lite.Interpreter
+    return Interpreter
+
+class TFLiteBackend:
+    """Serve a (possibly quantized) .tflite export through the TFLite interpreter"""
+    name = 'tflite'
+
+    def __init__(self, model_path, num_threads=None):
+        Interpreter = _load_interpreter_class()
+        self.interpreter = Interpreter(model_path=model_path, num_threads=num_threads)
+        self.interpreter.allocate_tensors()
+        self.input_details = self.interpreter.get_input_details()[0]
+        self.output_details = self.interpreter.get_output_details()[0]
+        self.batch_size = int(self.input_details['shape'][0])
+
+    def _resize(self, batch_size):
+        # The interpreter has a fixed batch dimension until it is resized
+        index = self.input_details['index']
+        shape = list(self.input_details['shape'])
+        shape[0] = batch_size
+        self.interpreter.resize_tensor_input(index, shape)
+        self.interpreter.allocate_tensors()
+        self.input_details = self.interpreter.get_input_details()[0]
+        self.output_details = self.interpreter.get_output_details()[0]
+        self.batch_size = batch_size
+
+    def _input_tensor(self):
+        # A view of the interpreter's own input memory; it must be released
+        # before invoke(), which refuses to run while references are held
+        return self.interpreter.tensor(self.input_details['index'])()
+
+    def _quantize_into(self, batch, out):
+        scale, zero_point = self.input_details['quantization']
+        info = np.iinfo(out.dtype)
+        quantized = batch / scale + zero_point
+        np.rint(quantized, out=quantized)
+        np.clip(quantized, info.min, info.max, out=quantized)
+        np.copyto(out, quantized, casting='unsafe')
+
+    def _takes_raw_pixels(self):
+        # uint8 inputs quantized with scale 1/255 and zero point 0 are the pixel values themselves
+        scale, zero_point = self.input_details['quantization']
+        return (self.input_details['dtype'] == np.uint8 and zero_point == 0
+                and abs(scale * 255.0 - 1.0) < 1e-3)
+
+    def _dequantize(self, output):
+        if self.output_details['dtype'] == np.float32:
+            return output
+        scale, zero_point = self.output_details['quantization']
+        return (output.astype(np.float32) - zero_point) * scale
+
+    def _invoke(self):
+        self.interpreter.invoke()
+        # get_tensor returns a copy, so the result outlives the next invoke()
+        return self._dequantize(self.interpreter.get_tensor(self.output_details['index']))
+
+    def predict(self, batch):
+        """Run a float32 NHWC batch and return the probabilities as numpy"""
+        if batch.shape[0] != self.batch_size:
+            self._resize(batch.shape[0])
+        tensor = self._input_tensor()
+        if tensor.dtype == np.float32:
+            np.copyto(tensor, batch)
+        else:
+            self._quantize_into(batch, tensor)
+        del tensor
+        return self._invoke()
+
+    def predict_pixels(self, pixels):
+        """Run a uint8 NHWC batch of decoded images, written straight into the input tensor"""
+        if pixels.shape[0] != self.batch_size:
+            self._resize(pixels.shape[0])
+        tensor = self._input_tensor()
+        if tensor.dtype == np.float32:
+            scale_into(pixels, tensor)
+        elif self._takes_raw_pixels():
+            np.copyto(tensor, pixels)
+        else:
+            self._quantize_into(pixels * np.float32(1.0 / 255.0), tensor)
+        del tensor
+        return self._invoke()
@@ -0,0 +1,124 @@
+import argparse
+import base64
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+# Compare cold start, resident memory and per-request latency of the serving
+# backends. Each backend runs in a fresh interpreter so import and load costs
+# are measured the way a new function instance pays them.
+
+CLOUD_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(CLOUD_DIR)
+DEFAULT_IMAGE_DIR = os.path.join(PROJECT_ROOT, "raw_dataset")
+
+def collect_images(image_dir, limit):
+    """Return up to `limit` base64-encoded images from the dataset"""
+    encoded = []
+    for root, _, files in sorted(os.walk(image_dir)):
+        for name in sorted(files):
+            if not name.lower().endswith(('.png', '.jpg', '.jpeg')):
+                continue
+            with open(os.path.join(root, name), 'rb') as f:
+                encoded.append(base64.b64encode(f.read()).decode('utf-8'))
+            if len(encoded) >= limit:
+                return encoded
+    return encoded
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def run_worker(args):
+    """Measure one backend inside this (fresh) process and print JSON"""
+    start = time.perf_counter()
+    import main
+    main.initialize()
+    cold_start = time.perf_counter() - start
+
+    images = collect_images(args.image_dir, args.requests)
+    if not images:
+        raise SystemExit(f"No images found in {args.image_dir}")
+
+    # Time the same path predict() takes: in-graph decoding when the model
+    # exports serve_bytes, otherwise PIL decoding into the session buffer
+    served = main.current_model
+    latencies = []
+    for image_data in images:
+        request_start = time.perf_counter()
+        raw = base64.b64decode(image_data)
+        if served.use_graph_preprocess:
+            served.run_bytes([raw])
+        else:
+            served.run_image(main.decode_image(raw, served.input_size))
+        latencies.append((time.perf_counter() - request_start) * 1000)
+
+    # ru_maxrss is reported in kilobytes on Linux
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps({
+        "backend": main.MODEL_BACKEND,
+        "cold_start_s": cold_start,
+        "model_load_s": main.model_load_seconds,
+        "graph_preprocess": served.use_graph_preprocess,
+        "peak_rss_mb": peak_rss_mb,
+        "requests": len(latencies),
+        "latency_ms_mean": sum(latencies) / len(latencies),
+        "latency_ms_p50": percentile(latencies, 50),
+        "latency_ms_p95": percentile(latencies, 95),
+    }))
+
+def measure_backend(backend, args):
+    env = dict(os.environ, MODEL_BACKEND=backend, EAGER_LOAD='0')
+    if args.tflite_path:
+        env['TFLITE_MODEL_PATH'] = os.path.abspath(args.tflite_path)
+    cmd = [sys.executable, os.path.abspath(__file__), "--worker",
+           "--image_dir", args.image_dir, "--requests", str(args.requests)]
+    result = subprocess.run(cmd, cwd=CLOUD_DIR, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        print(f"Backend '{backend}' failed:\n{result.stderr}")
+        return None
+    # The worker prints its report as the last line of stdout
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare cloud serving backends")
+    parser.add_argument("--backends", type=str, default="savedmodel,tflite",
+                        help="Comma-separated backends to compare (default: savedmodel,tflite)")
+    parser.add_argument("--requests", type=int, default=50,
+                        help="Number of requests to time per backend (default: 50)")
+    parser.add_argument("--image_dir", type=str, default=DEFAULT_IMAGE_DIR,
+                        help="Directory of sample images (default: raw_dataset)")
+    parser.add_argument("--tflite_path", type=str,
+                        help="Custom .tflite file (default: cloud/model/tomato_model.tflite)")
+    parser.add_argument("--output", type=str, help="Optional path to save the results as JSON")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return 0
+
+    results = []
+    for backend in args.backends.split(','):
+        print(f"Measuring {backend} backend...")
+        report = measure_backend(backend.strip(), args)
+        if report:
+            results.append(report)
+
+    print(f"\n{'backend':<12}{'cold start':>12}{'peak RSS':>12}{'mean':>10}{'p50':>10}{'p95':>10}")
+    for r in results:
+        print(f"{r['backend']:<12}{r['cold_start_s']:>11.2f}s{r['peak_rss_mb']:>9.0f} MB"
+              f"{r['latency_ms_mean']:>8.1f}ms{r['latency_ms_p50']:>8.1f}ms{r['latency_ms_p95']:>8.1f}ms")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults saved to: {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,330 @@
+import argparse
+import base64
+import datetime
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+# Local load generator for detect_tomato_disease. Starts the function with
+# functions_framework against the bundled cloud/model, replays images from
+# raw_dataset and reports throughput, latency percentiles, error rate and the
+# server's resident memory over time. Results are saved as JSON so runs can be
+# compared before and after serving changes.
+
+CLOUD_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(CLOUD_DIR)
+DEFAULT_IMAGE_DIR = os.path.join(PROJECT_ROOT, "raw_dataset")
+DEFAULT_RESULTS_DIR = os.path.join(CLOUD_DIR, "load_test_results")
+
+def load_payloads(image_dir, limit):
+    """Read up to `limit` images and encode them as request bodies"""
+    paths = []
+    for root, _, files in sorted(os.walk(image_dir)):
+        paths.extend(os.path.join(root, f) for f in sorted(files)
+                     if f.lower().endswith(('.png', '.jpg', '.jpeg')))
+    if not paths:
+        raise SystemExit(f"No images found in {image_dir}")
+    random.Random(42).shuffle(paths)
+
+    payloads = []
+    for path in paths[:limit]:
+        with open(path, 'rb') as f:
+            encoded = base64.b64encode(f.read()).decode('utf-8')
+        payloads.append(json.dumps({"image": encoded}).encode('utf-8'))
+    return payloads
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def read_rss_mb(pid):
+    """Resident memory of a process in MB (Linux /proc), or None"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+def start_server(port, env_overrides, log_file):
+    """Start the function locally with functions_framework"""
+    env = dict(os.environ, **env_overrides)
+    cmd = [sys.executable, "-m", "functions_framework",
+           "--target", "detect_tomato_disease", "--source", "main.py",
+           "--host", "127.0.0.1", "--port", str(port)]
+    return subprocess.Popen(cmd, cwd=CLOUD_DIR, env=env,
+                            stdout=log_file, stderr=subprocess.STDOUT)
+
+def wait_until_ready(url, server, log_file, timeout):
+    """Poll the readiness probe until the model is loaded and warmed up"""
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        if server.poll() is not None:
+            log_file.seek(0)
+            raise SystemExit(f"Server exited early:\n{log_file.read().decode(errors='replace')}")
+        try:
+            with urllib.request.urlopen(url, timeout=5) as response:
+                if response.status == 200:
+                    return time.perf_counter() - start
+        except (urllib.error.URLError, ConnectionError):
+            pass
+        time.sleep(0.25)
+    raise SystemExit(f"Server not ready after {timeout}s")
+
+def send_request(url, payload, timeout):
+    """POST one image and return (latency_seconds, ok)"""
+    request = urllib.request.Request(url, data=payload,
+                                     headers={"Content-Type": "application/json"})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+            ok = response.status == 200
+    except (urllib.error.URLError, ConnectionError, TimeoutError):
+        ok = False
+    return time.perf_counter() - start, ok
+
+class Recorder:
+    """Thread-safe collection of request outcomes"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.errors = 0
+
+    def add(self, latency, ok):
+        with self.lock:
+            if ok:
+                self.latencies.append(latency)
+            else:
+                self.errors += 1
+
+def run_closed_loop(url, payloads, concurrency, duration, timeout, recorder):
+    """Each worker sends its next request as soon as the previous one returns"""
+    deadline = time.perf_counter() + duration
+
+    def worker(worker_id):
+        i = worker_id
+        while time.perf_counter() < deadline:
+            recorder.add(*send_request(url, payloads[i % len(payloads)], timeout))
+            i += concurrency
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for worker_id in range(concurrency):
+            executor.submit(worker, worker_id)
+
+def run_open_loop(url, payloads, rate, duration, timeout, recorder, max_in_flight):
+    """Send requests on a fixed schedule regardless of how fast they complete"""
+    interval = 1.0 / rate
+    start = time.perf_counter()
+    total = int(rate * duration)
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        for i in range(total):
+            delay = start + i * interval - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(lambda p: recorder.add(*send_request(url, p, timeout)),
+                            payloads[i % len(payloads)])
+
+def sample_rss(pid, stop, interval, samples):
+    start = time.perf_counter()
+    while not stop.is_set():
+        rss = read_rss_mb(pid)
+        if rss is not None:
+            samples.append({"t": round(time.perf_counter() - start, 2), "rss_mb": round(rss, 1)})
+        stop.wait(interval)
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def summarize(recorder, elapsed):
+    latencies_ms = [l * 1000 for l in recorder.latencies]
+    total = len(latencies_ms) + recorder.errors
+    return {
+        "requests": total,
+        "errors": recorder.errors,
+        "error_rate": recorder.errors / total if total else 0.0,
+        "throughput_rps": total / elapsed if elapsed else 0.0,
+        "latency_ms": {
+            "mean": sum(latencies_ms) / len(latencies_ms) if latencies_ms else None,
+            "p50": percentile(latencies_ms, 50),
+            "p95": percentile(latencies_ms, 95),
+            "p99": percentile(latencies_ms, 99),
+            "max": max(latencies_ms) if latencies_ms else None,
+        },
+    }
+
+def compare_to_baseline(result, baseline_path, max_regression):
+    """Return a list of regressions larger than `max_regression` percent"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    current, previous = result["summary"], baseline["summary"]
+    regressions = []
+
+    # Higher is worse for latency and error rate, lower is worse for throughput
+    checks = [
+        ("p95 latency", current["latency_ms"]["p95"], previous["latency_ms"]["p95"], 1),
+        ("p99 latency", current["latency_ms"]["p99"], previous["latency_ms"]["p99"], 1),
+        ("throughput", current["throughput_rps"], previous["throughput_rps"], -1),
+    ]
+    print(f"\nComparison with {baseline_path} ({baseline.get('label')}):")
+    for name, now, before, direction in checks:
+        if now is None or not before:
+            continue
+        change = (now - before) / before * 100
+        print(f"- {name}: {before:.1f} -> {now:.1f} ({change:+.1f}%)")
+        if change * direction > max_regression:
+            regressions.append(f"{name} regressed by {abs(change):.1f}%")
+    if current["error_rate"] > previous["error_rate"]:
+        regressions.append(f"error rate rose from {previous['error_rate']:.1%} "
+                           f"to {current['error_rate']:.1%}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the cloud inference function locally")
+    parser.add_argument("--concurrency", type=int, default=4,
+                        help="Closed-loop concurrent clients (default: 4)")
+    parser.add_argument("--rate", type=float,
+                        help="Open-loop request rate per second (overrides --concurrency)")
+    parser.add_argument("--duration", type=float, default=30,
+                        help="Measured test duration in seconds (default: 30)")
+    parser.add_argument("--warmup", type=float, default=5,
+                        help="Unmeasured warm-up duration in seconds (default: 5)")
+    parser.add_argument("--images", type=int, default=200,
+                        help="Number of distinct images to replay (default: 200)")
+    parser.add_argument("--image_dir", type=str, default=DEFAULT_IMAGE_DIR,
+                        help="Directory of images to replay (default: raw_dataset)")
+    parser.add_argument("--url", type=str,
+                        help="Test an already running function instead of starting one")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="Environment for the started server, e.g. --env MODEL_BACKEND=tflite")
+    parser.add_argument("--timeout", type=float, default=30,
+                        help="Per-request timeout in seconds (default: 30)")
+    parser.add_argument("--label", type=str, default="run",
+                        help="Name for this run in the results file (default: run)")
+    parser.add_argument("--output", type=str,
+                        help="Results JSON path (default: cloud/load_test_results/<label>_<time>.json)")
+    parser.add_argument("--baseline", type=str,
+                        help="Earlier results JSON to compare against; exits 1 on regression")
+    parser.add_argument("--max_regression", type=float, default=10.0,
+                        help="Allowed regression in percent when comparing (default: 10)")
+    args = parser.parse_args()
+
+    payloads = load_payloads(args.image_dir, args.images)
+    print(f"Loaded {len(payloads)} images from {args.image_dir}")
+
+    env_overrides = dict(item.split('=', 1) for item in args.env)
+    server = None
+    ready_seconds = None
+    log_file = tempfile.TemporaryFile()
+    if args.url:
+        url = args.url
+    else:
+        port = free_port()
+        url = f"http://127.0.0.1:{port}/"
+        print(f"Starting function on port {port} with {env_overrides or 'default settings'}...")
+        server = start_server(port, env_overrides, log_file)
+
+    rss_samples = []
+    stop_sampling = threading.Event()
+    try:
+        if server:
+            ready_seconds = wait_until_ready(url, server, log_file, timeout=300)
+            print(f"Server ready after {ready_seconds:.1f}s")
+            threading.Thread(target=sample_rss, daemon=True,
+                             args=(server.pid, stop_sampling, 1.0, rss_samples)).start()
+
+        def run(duration, recorder):
+            if args.rate:
+                run_open_loop(url, payloads, args.rate, duration, args.timeout, recorder,
+                              max_in_flight=max(args.concurrency, int(args.rate * args.timeout)))
+            else:
+                run_closed_loop(url, payloads, args.concurrency, duration, args.timeout, recorder)
+
+        if args.warmup > 0:
+            print(f"Warming up for {args.warmup:.0f}s...")
+            run(args.warmup, Recorder())
+
+        mode = f"open loop at {args.rate} req/s" if args.rate else f"{args.concurrency} concurrent clients"
+        print(f"Measuring for {args.duration:.0f}s ({mode})...")
+        recorder = Recorder()
+        start = time.perf_counter()
+        run(args.duration, recorder)
+        elapsed = time.perf_counter() - start
+    finally:
+        stop_sampling.set()
+        if server:
+            server.terminate()
+            server.wait(timeout=30)
+        log_file.close()
+
+    summary = summarize(recorder, elapsed)
+    result = {
+        "label": args.label,
+        "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "config": {
+            "mode": "open" if args.rate else "closed",
+            "concurrency": args.concurrency,
+            "rate": args.rate,
+            "duration_s": args.duration,
+            "images": len(payloads),
+            "env": env_overrides,
+            "url": args.url,
+        },
+        "server_ready_s": ready_seconds,
+        "summary": summary,
+        "server_rss_mb": {
+            "peak": max((s["rss_mb"] for s in rss_samples), default=None),
+            "samples": rss_samples,
+        },
+    }
+
+    latency = summary["latency_ms"]
+    print(f"\nRequests: {summary['requests']}  errors: {summary['errors']} "
+          f"({summary['error_rate']:.1%})")
+    print(f"Throughput: {summary['throughput_rps']:.1f} req/s")
+    if latency["p50"] is not None:
+        print(f"Latency: p50 {latency['p50']:.1f}ms  p95 {latency['p95']:.1f}ms  "
+              f"p99 {latency['p99']:.1f}ms  max {latency['max']:.1f}ms")
+    if result["server_rss_mb"]["peak"] is not None:
+        print(f"Server peak RSS: {result['server_rss_mb']['peak']:.0f} MB")
+
+    output = args.output
+    if not output:
+        os.makedirs(DEFAULT_RESULTS_DIR, exist_ok=True)
+        stamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        output = os.path.join(DEFAULT_RESULTS_DIR, f"{args.label}_{stamp}.json")
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2)
+    print(f"Results saved to: {output}")
+
+    if summary["requests"] == 0:
+        return 1
+    if args.baseline:
+        regressions = compare_to_baseline(result, args.baseline, args.max_regression)
+        if regressions:
+            print("\nRegressions found:")
+            for regression in regressions:
+                print(f"- {regression}")
+            return 1
+        print("No regressions beyond the threshold")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
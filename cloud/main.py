@@ -1,57 +1,355 @@
 import os
+import re
+import hmac
 import json
-import tensorflow as tf
+import threading
+import time
 import numpy as np
 from flask import jsonify
-from PIL import Image
+from PIL import Image, ImageOps
 from io import BytesIO
 import base64
+import binascii
 import functions_framework
+from session_pool import create_session_pool
+from backends import InvalidImageError
+import metrics
 
 # Path to the saved model directory relative to the function's root
 MODEL_DIR = 'model'
-CLASS_INFO_PATH = os.path.join(MODEL_DIR, 'class_info.json')
 
-# Load model on cold start
-model = None
-class_names = None
+# Versioned model directories: MODELS_ROOT/<version>/ each hold a SavedModel,
+# class_info.json and optionally tomato_model.tflite. MODELS_ROOT/CURRENT names
+# the version to serve; without it the highest version wins. When MODELS_ROOT
+# does not exist the single MODEL_DIR is served as before.
+MODELS_ROOT = os.environ.get('MODELS_ROOT', 'models')
 
-def load_model():
-    global model, class_names
+# Seconds between checks for a new model version (0 disables the watcher)
+MODEL_WATCH_INTERVAL = float(os.environ.get('MODEL_WATCH_INTERVAL', '0'))
+
+# Token required by POST /admin/reload (the endpoint is disabled without it)
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+
+# Serving backend: 'savedmodel' (full TensorFlow) or 'tflite' (lighter runtime)
+MODEL_BACKEND = os.environ.get('MODEL_BACKEND', 'savedmodel')
+TFLITE_MODEL_PATH = os.environ.get('TFLITE_MODEL_PATH')
+TFLITE_MODEL_NAME = 'tomato_model.tflite'
+
+# Batch sizes traced during warm-up, e.g. WARMUP_BATCH_SIZES=1,8
+WARMUP_BATCH_SIZES = [
+    int(size) for size in os.environ.get('WARMUP_BATCH_SIZES', '1').split(',')
+    if size.strip()
+]
+
+# Number of concurrent inference sessions and threads per session
+# (defaults: one session per core, cores split evenly between sessions)
+POOL_SIZE = int(os.environ.get('POOL_SIZE', '0')) or None
+INTRA_OP_THREADS = int(os.environ.get('INTRA_OP_THREADS', '0')) or None
+
+# Seconds a request may wait for a free session before failing
+POOL_TIMEOUT = float(os.environ.get('POOL_TIMEOUT', '30'))
+
+# Let the model decode and preprocess raw bytes when it exports `serve_bytes`
+GRAPH_PREPROCESS = os.environ.get('GRAPH_PREPROCESS', '1') == '1'
+
+# Start loading as soon as the instance boots instead of on the first request
+EAGER_LOAD = os.environ.get('EAGER_LOAD', '1') == '1'
+
+# Request metrics, scraped in Prometheus text format from GET /metrics
+METRICS = metrics.Registry()
+REQUESTS = METRICS.counter(
+    'tomato_requests_total', 'Prediction requests by HTTP status', ['status'])
+ERRORS = METRICS.counter(
+    'tomato_errors_total', 'Failed prediction requests by reason', ['reason'])
+REQUEST_LATENCY = METRICS.histogram(
+    'tomato_request_seconds', 'End-to-end prediction request latency')
+STAGE_LATENCY = METRICS.histogram(
+    'tomato_stage_seconds', 'Latency of each prediction stage', ['stage'])
+POOL_WAIT = METRICS.histogram(
+    'tomato_pool_wait_seconds', 'Time spent waiting for a free inference session')
+BATCH_SIZE = METRICS.histogram(
+    'tomato_batch_size', 'Images per model invocation', buckets=(1, 2, 4, 8, 16, 32, 64))
+MODEL_SWAPS = METRICS.counter(
+    'tomato_model_swaps_total', 'Model versions swapped in, by outcome', ['outcome'])
+
+class ServedModel:
+    """One loaded, warmed-up model version and its pool of inference sessions"""
+    
+    def __init__(self, version, model_dir):
+        self.version = version
+        self.model_dir = model_dir
+        self.pool = None
+        self.class_names = None
+        self.input_shape = (96, 96, 3)
+        self.use_graph_preprocess = False
+        self.load_seconds = None
+    
+    def load(self):
+        start = time.perf_counter()
+        
+        # Load class names
+        with open(os.path.join(self.model_dir, 'class_info.json'), 'r') as f:
+            class_info = json.load(f)
+            self.class_names = class_info["classes"]
+            self.input_shape = tuple(class_info.get("input_shape", self.input_shape))
+        if self.version is None:
+            self.version = str(class_info.get("version", self.model_dir))
+        
+        # Build the pool of inference sessions for the configured backend
+        tflite_path = TFLITE_MODEL_PATH or os.path.join(self.model_dir, TFLITE_MODEL_NAME)
+        self.pool = create_session_pool(
+            MODEL_BACKEND, self.model_dir, tflite_path,
+            input_shape=self.input_shape,
+            pool_size=POOL_SIZE,
+            threads_per_session=INTRA_OP_THREADS,
+            max_batch_size=max(WARMUP_BATCH_SIZES + [1]),
+            wait_observer=POOL_WAIT.observe
+        )
+        self.use_graph_preprocess = GRAPH_PREPROCESS and self.pool.sessions[0].accepts_bytes
+        
+        print(f"Model {self.version} loaded successfully ({MODEL_BACKEND} backend). "
+              f"Class names: {self.class_names}")
+        if self.use_graph_preprocess:
+            print("Using the model's in-graph preprocessing (serve_bytes)")
+        
+        self.warm_up()
+        self.load_seconds = time.perf_counter() - start
+        return self
     
-    # Load the model
-    model = tf.saved_model.load(MODEL_DIR)
-    model_func = model.signatures["serve"]
+    def warm_up(self):
+        # Trace every session for each batch size so real requests skip it.
+        # Largest first, so TFLite interpreters end up allocated for small batches.
+        for session in self.pool.sessions:
+            for batch_size in sorted(WARMUP_BATCH_SIZES, reverse=True):
+                session.input_buffer[:batch_size] = 0
+                session.run(batch_size)
+                if self.use_graph_preprocess:
+                    session.run_bytes([_blank_jpeg(self.input_size)] * batch_size)
+        print(f"Model {self.version} warmed up for batch sizes: {WARMUP_BATCH_SIZES}")
     
-    # Load class names
-    with open(CLASS_INFO_PATH, 'r') as f:
-        class_info = json.load(f)
-        class_names = class_info["classes"]
+    @property
+    def input_size(self):
+        # (width, height) as PIL expects it
+        return (self.input_shape[1], self.input_shape[0])
     
-    print(f"Model loaded successfully. Class names: {class_names}")
-    return model_func
+    def run_image(self, img):
+        # Hand the decoded uint8 pixels to a pooled session, which writes them
+        # straight into the model's input (see InferenceSession.run_pixels)
+        BATCH_SIZE.observe(1)
+        with STAGE_LATENCY.time(stage='tensor_convert'):
+            pixels = np.asarray(img)[np.newaxis]
+        # Like the graph path, the model stage includes the wait for a session
+        with STAGE_LATENCY.time(stage='model'):
+            with self.pool.checkout(timeout=POOL_TIMEOUT) as session:
+                return session.run_pixels(pixels)
+    
+    def run_bytes(self, encoded_images):
+        # Let the model decode, resize and contrast-enhance the images in its graph
+        BATCH_SIZE.observe(len(encoded_images))
+        with self.pool.checkout(timeout=POOL_TIMEOUT) as session:
+            return session.run_bytes(encoded_images)
+
+# Model state shared by all requests on this instance. Requests read
+# `current_model` once, so a swap never affects a request already in flight.
+current_model = None
+model_ready = False
+model_error = None
+model_load_seconds = None
+_model_lock = threading.Lock()
+_reload_lock = threading.Lock()
+
+METRICS.gauge('tomato_model_ready', 'Whether the model is loaded and warmed up',
+              lambda: 1 if model_ready else 0)
+METRICS.gauge('tomato_pool_sessions_in_use', 'Inference sessions currently checked out',
+              lambda: current_model.pool.stats()['in_use'] if current_model else None)
+
+def _blank_jpeg(size=(96, 96)):
+    buffer = BytesIO()
+    Image.new('RGB', size).save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+def _version_key(name):
+    # Natural sort so v10 comes after v9
+    return [(0, int(part), '') if part.isdigit() else (1, 0, part)
+            for part in re.split(r'(\d+)', name) if part]
+
+def list_model_versions():
+    if not os.path.isdir(MODELS_ROOT):
+        return []
+    versions = [d for d in os.listdir(MODELS_ROOT)
+                if os.path.isdir(os.path.join(MODELS_ROOT, d))]
+    return sorted(versions, key=_version_key)
+
+def resolve_model_version():
+    """Return (version, model_dir) of the model that should be served"""
+    versions = list_model_versions()
+    if not versions:
+        # Unversioned layout: the version comes from class_info.json
+        return None, MODEL_DIR
+    
+    current_file = os.path.join(MODELS_ROOT, 'CURRENT')
+    if os.path.exists(current_file):
+        with open(current_file, 'r') as f:
+            version = f.read().strip()
+        if version in versions:
+            return version, os.path.join(MODELS_ROOT, version)
+        print(f"Version '{version}' in {current_file} not found, serving the latest")
+    return versions[-1], os.path.join(MODELS_ROOT, versions[-1])
 
-# Preprocess image to match model's expected input
-def preprocess_image(image_data):
-    # Decode base64 image
-    img = Image.open(BytesIO(base64.b64decode(image_data)))
+def load_model():
+    # Load and warm up the model version that should currently be served
+    version, model_dir = resolve_model_version()
+    return ServedModel(version, model_dir).load()
+
+def initialize():
+    global current_model, model_ready, model_error, model_load_seconds
     
-    # Resize and convert to array
-    img = img.resize((96, 96))
-    img_array = tf.image.convert_image_dtype(np.array(img), tf.float32)
+    # Fast path once the model is loaded and warmed up
+    if model_ready:
+        return
     
-    # Add batch dimension
-    img_array = tf.expand_dims(img_array, 0)
+    # Only one thread loads the model; the others wait for it to finish
+    with _model_lock:
+        if model_ready:
+            return
+        try:
+            current_model = load_model()
+            model_load_seconds = current_model.load_seconds
+            model_error = None
+            model_ready = True
+        except Exception as e:
+            model_error = str(e)
+            raise
+
+def reload_model(version=None):
+    """Load and warm up a model version off the request path, then swap it in
+
+    Requests already in flight keep the version they started with; the old
+    version is released once they finish.
+    """
+    global current_model, model_load_seconds
     
-    return img_array
+    # One reload at a time; the request path never takes this lock
+    with _reload_lock:
+        if version is None:
+            version, model_dir = resolve_model_version()
+        elif version in list_model_versions():
+            model_dir = os.path.join(MODELS_ROOT, version)
+        else:
+            MODEL_SWAPS.inc(outcome='not_found')
+            raise ValueError(f"Unknown model version '{version}'")
+        
+        if current_model is not None and version == current_model.version:
+            return current_model
+        
+        try:
+            new_model = ServedModel(version, model_dir).load()
+        except Exception:
+            MODEL_SWAPS.inc(outcome='failed')
+            raise
+        
+        # A single reference assignment, so the swap is atomic between requests
+        old_version = current_model.version if current_model else None
+        current_model = new_model
+        model_load_seconds = new_model.load_seconds
+        MODEL_SWAPS.inc(outcome='swapped')
+        print(f"Swapped model {old_version} -> {new_model.version}")
+        return new_model
+
+def _reload_in_background(version=None):
+    try:
+        reload_model(version)
+    except Exception as e:
+        print(f"Model reload failed: {str(e)}")
+
+def _model_dir_signature(model_dir):
+    # Changes whenever a file in the version directory is added, removed or rewritten
+    entries = []
+    for root, dirs, files in os.walk(model_dir):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((os.path.relpath(path, model_dir), stat.st_size, stat.st_mtime_ns))
+    return tuple(entries)
+
+def _watch_model_versions():
+    # Poll MODELS_ROOT and swap in new versions as they appear. A version that
+    # fails to load is not retried until its directory changes.
+    failed_versions = {}
+    while True:
+        time.sleep(MODEL_WATCH_INTERVAL)
+        if not model_ready:
+            continue
+        try:
+            version, model_dir = resolve_model_version()
+            if version is None or version == current_model.version:
+                continue
+            signature = _model_dir_signature(model_dir)
+            if failed_versions.get(version) == signature:
+                continue
+            try:
+                reload_model(version)
+                failed_versions.pop(version, None)
+            except Exception as e:
+                failed_versions[version] = signature
+                print(f"Model version {version} failed to load, not retrying until it changes: {str(e)}")
+        except Exception as e:
+            print(f"Model watcher failed: {str(e)}")
+
+def _initialize_in_background():
+    try:
+        initialize()
+    except Exception as e:
+        print(f"Model initialization failed: {str(e)}")
+
+if EAGER_LOAD:
+    threading.Thread(target=_initialize_in_background, daemon=True).start()
+
+if MODEL_WATCH_INTERVAL > 0:
+    threading.Thread(target=_watch_model_versions, daemon=True).start()
+
+def decode_image(raw, size=(96, 96)):
+    # Decode to an upright RGB image of `size` (width, height).
+    # JPEG draft mode lets the decoder scale by 1/2, 1/4 or 1/8 in the DCT,
+    # as long as the result still covers `size`, so large photos are never
+    # decoded at full resolution.
+    img = Image.open(BytesIO(raw))
+    img.draft('RGB', size)
+    img = ImageOps.exif_transpose(img)
+    if img.mode != 'RGB':
+        if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+            # Flatten transparency onto white rather than the hidden pixel values
+            rgba = img.convert('RGBA')
+            img = Image.new('RGB', rgba.size, (255, 255, 255))
+            img.paste(rgba, mask=rgba.getchannel('A'))
+        else:
+            img = img.convert('RGB')
+    if img.size != size:
+        img = img.resize(size)
+    return img
 
 @functions_framework.http
 def detect_tomato_disease(request):
-    global model, class_names
-    
-    # Load model if not already loaded (handles cold starts)
-    if model is None:
-        load_model()
+    if request.method == 'GET':
+        # Prometheus scrape endpoint
+        if request.path.rstrip('/').endswith('/metrics'):
+            return METRICS.render(), 200, {'Content-Type': metrics.CONTENT_TYPE}
+        
+        # Readiness probe: only report ready once the model is loaded and warmed up
+        if model_ready:
+            served = current_model
+            return jsonify({
+                'ready': True,
+                'backend': MODEL_BACKEND,
+                'model_version': served.version,
+                'load_seconds': model_load_seconds,
+                'pool': served.pool.stats()
+            }), 200
+        return jsonify({'ready': False, 'error': model_error}), 503
     
     # Set CORS headers for the preflight request
     if request.method == 'OPTIONS':
@@ -65,12 +363,45 @@ def detect_tomato_disease(request):
         }
         return ('', 204, headers)
     
+    # Admin trigger to load, warm up and swap in a model version
+    if request.path.rstrip('/').endswith('/admin/reload'):
+        return admin_reload(request)
+    
+    start = time.perf_counter()
+    response, status, headers = predict(request)
+    REQUESTS.inc(status=str(status))
+    REQUEST_LATENCY.observe(time.perf_counter() - start)
+    return response, status, headers
+
+def admin_reload(request):
+    # Disabled unless ADMIN_TOKEN is configured
+    token = request.headers.get('X-Admin-Token', '')
+    if not ADMIN_TOKEN or not hmac.compare_digest(token, ADMIN_TOKEN):
+        return jsonify({'error': 'Not found'}), 404
+    
+    request_json = request.get_json(silent=True) or {}
+    version = request_json.get('version')
+    if version is not None and version not in list_model_versions():
+        return jsonify({
+            'error': f"Unknown model version '{version}'",
+            'available_versions': list_model_versions()
+        }), 400
+    
+    # Load and warm up in the background; requests keep using the current version
+    threading.Thread(target=_reload_in_background, args=(version,), daemon=True).start()
+    return jsonify({
+        'reloading': version or 'latest',
+        'current_version': current_model.version if current_model else None
+    }), 202
+
+def predict(request):
     # Set CORS headers for the main request
     headers = {'Access-Control-Allow-Origin': '*'}
     
     # Check if request is properly formed
     request_json = request.get_json(silent=True)
     if not request_json or 'image' not in request_json:
+        ERRORS.inc(reason='invalid_request')
         return jsonify({
             'error': 'Invalid request. Please provide an image in base64 format.'
         }), 400, headers
@@ -78,26 +409,40 @@ def detect_tomato_disease(request):
     # Get the base64 encoded image
     image_data = request_json['image']
     if not image_data:
+        ERRORS.inc(reason='empty_image')
         return jsonify({
             'error': 'Empty image data'
         }), 400, headers
     
+    # Wait for the startup load (or load now if eager loading is disabled)
     try:
-        # Preprocess the image
-        img_tensor = preprocess_image(image_data)
-        
-        # Run inference
-        predictions = model(img_tensor)
-        
-        # Get the results
-        if isinstance(predictions, dict):
-            # For saved_model format
-            prediction_values = predictions[next(iter(predictions))].numpy()[0]
+        initialize()
+    except Exception as e:
+        ERRORS.inc(reason='model_unavailable')
+        return jsonify({
+            'error': f'Model not available: {str(e)}'
+        }), 503, headers
+    
+    # Serve the whole request from one model version, even if a swap happens
+    served = current_model
+    
+    try:
+        if served.use_graph_preprocess:
+            # Preprocess and run inference inside the model graph
+            with STAGE_LATENCY.time(stage='base64_decode'):
+                raw = base64.b64decode(image_data)
+            with STAGE_LATENCY.time(stage='model'):
+                prediction_values = served.run_bytes([raw])[0]
         else:
-            # For direct model format
-            prediction_values = predictions.numpy()[0]
+            # Decode the image, then run inference on it straight from the session buffer
+            with STAGE_LATENCY.time(stage='base64_decode'):
+                raw = base64.b64decode(image_data)
+            with STAGE_LATENCY.time(stage='image_decode'):
+                img = decode_image(raw, served.input_size)
+            prediction_values = served.run_image(img)[0]
         
         # Get the predicted class
+        class_names = served.class_names
         predicted_class_idx = np.argmax(prediction_values)
         predicted_class = class_names[predicted_class_idx]
         confidence = float(prediction_values[predicted_class_idx])
@@ -109,12 +454,32 @@ def detect_tomato_disease(request):
             'all_probabilities': {
                 class_name: float(prediction_values[i]) 
                 for i, class_name in enumerate(class_names)
-            }
+            },
+            'model_version': served.version
         }
         
-        return jsonify(results), 200, headers
+        with STAGE_LATENCY.time(stage='serialize'):
+            response = jsonify(results)
+        return response, 200, headers
+        
+    except TimeoutError as e:
+        # Every inference session stayed busy for POOL_TIMEOUT seconds
+        # (checked first: TimeoutError is itself an OSError)
+        ERRORS.inc(reason='pool_timeout')
+        return jsonify({
+            'error': f'Server busy: {str(e)}'
+        }), 503, headers
+        
+    except (binascii.Error, OSError, InvalidImageError) as e:
+        # PIL raises OSError for unreadable and truncated images
+        # (UnidentifiedImageError is one); the in-graph decoder InvalidImageError
+        ERRORS.inc(reason='invalid_image')
+        return jsonify({
+            'error': f'Invalid image data: {str(e)}'
+        }), 400, headers
         
     except Exception as e:
+        ERRORS.inc(reason='processing')
         return jsonify({
             'error': f'Error processing image: {str(e)}'
         }), 500, headers
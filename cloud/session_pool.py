@@ -0,0 +1,141 @@
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+from backends import SavedModelBackend, TFLiteBackend, scale_into
+
+class InferenceSession:
+    """One inference slot with a fixed, preallocated input buffer
+
+    Backends return freshly allocated probabilities, so results stay valid
+    after the session is checked back in.
+    """
+
+    def __init__(self, backend, input_shape, max_batch_size=1):
+        self.backend = backend
+        self.max_batch_size = max_batch_size
+        self.input_buffer = np.zeros((max_batch_size,) + tuple(input_shape), dtype=np.float32)
+
+    def run(self, batch_size=1):
+        """Run the first `batch_size` rows of the input buffer"""
+        return self.backend.predict(self.input_buffer[:batch_size])
+
+    def run_pixels(self, pixels):
+        """Run a uint8 NHWC batch of decoded images
+
+        TFLite writes the pixels straight into the interpreter's input tensor;
+        other backends read them from the input buffer, scaled to [0, 1].
+        """
+        predict_pixels = getattr(self.backend, 'predict_pixels', None)
+        if predict_pixels is not None:
+            return predict_pixels(pixels)
+        batch_size = len(pixels)
+        scale_into(pixels, self.input_buffer[:batch_size])
+        return self.run(batch_size)
+
+    @property
+    def accepts_bytes(self):
+        return getattr(self.backend, 'bytes_func', None) is not None
+
+    def run_bytes(self, encoded_images):
+        """Run encoded images through the model's in-graph preprocessing"""
+        return self.backend.predict_bytes(encoded_images)
+
+class SessionPool:
+    """Bounded pool of inference sessions that requests check out and back in"""
+
+    def __init__(self, sessions, wait_observer=None):
+        self.sessions = list(sessions)
+        self.wait_observer = wait_observer
+        self._available = queue.Queue()
+        for session in self.sessions:
+            self._available.put(session)
+
+        # Wait-time metrics
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.in_use = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    @property
+    def size(self):
+        return len(self.sessions)
+
+    @contextmanager
+    def checkout(self, timeout=None):
+        """Borrow a session, blocking until one is free (or `timeout` expires)"""
+        start = time.perf_counter()
+        try:
+            session = self._available.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No inference session available after {timeout}s")
+        waited = time.perf_counter() - start
+
+        with self._stats_lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.total_wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+        if self.wait_observer:
+            self.wait_observer(waited)
+        try:
+            yield session
+        finally:
+            with self._stats_lock:
+                self.in_use -= 1
+            self._available.put(session)
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'size': self.size,
+                'in_use': self.in_use,
+                'checkouts': self.checkouts,
+                'mean_wait_ms': 1000 * self.total_wait_seconds / max(self.checkouts, 1),
+                'max_wait_ms': 1000 * self.max_wait_seconds,
+            }
+
+def default_pool_size():
+    """One session per core"""
+    return os.cpu_count() or 1
+
+def default_threads_per_session(pool_size):
+    """Split the cores between sessions so pool_size * threads <= cores"""
+    return max(1, (os.cpu_count() or 1) // pool_size)
+
+def create_session_pool(name, model_dir, tflite_path, input_shape,
+                        pool_size=None, threads_per_session=None, max_batch_size=1,
+                        wait_observer=None):
+    """Build a pool of sessions for the selected backend
+
+    `pool_size` and `threads_per_session` of None or 0 mean the defaults.
+    TFLite sessions each own an interpreter with `threads_per_session`
+    threads. The SavedModel runtime is shared and thread-safe, so its sessions
+    share one loaded model. TensorFlow's thread pools are process-wide, so it
+    gets one inter-op thread per session, letting every session run an op at
+    once, and `threads_per_session` intra-op threads for splitting each op.
+    `wait_observer` is called with each checkout's wait in seconds.
+    """
+    pool_size = pool_size or default_pool_size()
+    threads_per_session = threads_per_session or default_threads_per_session(pool_size)
+
+    if name == SavedModelBackend.name:
+        shared = SavedModelBackend(model_dir, intra_op_threads=threads_per_session,
+                                   inter_op_threads=pool_size)
+        backends = [shared] * pool_size
+    elif name == TFLiteBackend.name:
+        backends = [TFLiteBackend(tflite_path, num_threads=threads_per_session)
+                    for _ in range(pool_size)]
+    else:
+        raise ValueError(f"Unknown model backend '{name}'. "
+                         f"Choose from: {[SavedModelBackend.name, TFLiteBackend.name]}")
+
+    sessions = [InferenceSession(backend, input_shape, max_batch_size)
+                for backend in backends]
+    print(f"Created {pool_size} {name} sessions with {threads_per_session} thread(s) each")
+    return SessionPool(sessions, wait_observer)
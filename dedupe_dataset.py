@@ -0,0 +1,250 @@
+import argparse
+import json
+import os
+import sys
+
+import cv2
+import numpy as np
+
+# Perceptual-hash (dHash) index of the raw dataset for finding near-duplicate
+# images. Hashes are 64-bit integers computed in vectorized batches; neighbour
+# search uses multi-index hashing, so only images that agree exactly on one
+# band of bits are compared. The index is cached on disk and only new or
+# modified images are re-hashed.
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+HASH_SIZE = 8  # 8x8 = 64-bit hashes
+DEFAULT_MAX_DISTANCE = 6
+BATCH_SIZE = 256
+
+_M1 = np.uint64(0x5555555555555555)
+_M2 = np.uint64(0x3333333333333333)
+_M4 = np.uint64(0x0f0f0f0f0f0f0f0f)
+_H01 = np.uint64(0x0101010101010101)
+
+def popcount64(x):
+    """Vectorized number of set bits in a uint64 array"""
+    x = x - ((x >> np.uint64(1)) & _M1)
+    x = (x & _M2) + ((x >> np.uint64(2)) & _M2)
+    x = (x + (x >> np.uint64(4))) & _M4
+    return ((x * _H01) >> np.uint64(56)).astype(np.int32)
+
+def hamming_distance(a, b):
+    """Bitwise Hamming distance between (broadcastable) uint64 hash arrays"""
+    return popcount64(np.bitwise_xor(a, b))
+
+def load_thumbnail(path):
+    """Grayscale (HASH_SIZE x HASH_SIZE+1) thumbnail, or None if unreadable"""
+    # Reduced decoding: JPEGs are decoded at 1/4 scale, which is plenty for a 9x8 thumbnail
+    img = cv2.imread(path, cv2.IMREAD_REDUCED_GRAYSCALE_4)
+    if img is None:
+        img = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        return None
+    return cv2.resize(img, (HASH_SIZE + 1, HASH_SIZE), interpolation=cv2.INTER_AREA)
+
+def dhash_batch(thumbnails):
+    """dHash of a stacked batch of thumbnails [N, 8, 9] as uint64 [N]"""
+    bits = thumbnails[:, :, 1:] > thumbnails[:, :, :-1]
+    packed = np.packbits(bits.reshape(len(thumbnails), -1), axis=1)
+    return packed.view('>u8').astype(np.uint64).ravel()
+
+def compute_hashes(paths, batch_size=BATCH_SIZE):
+    """Hash images in batches; returns (hashes, readable mask)"""
+    hashes = np.zeros(len(paths), dtype=np.uint64)
+    readable = np.zeros(len(paths), dtype=bool)
+    for start in range(0, len(paths), batch_size):
+        thumbnails, indices = [], []
+        for i in range(start, min(start + batch_size, len(paths))):
+            thumbnail = load_thumbnail(paths[i])
+            if thumbnail is not None:
+                thumbnails.append(thumbnail)
+                indices.append(i)
+        if thumbnails:
+            hashes[indices] = dhash_batch(np.stack(thumbnails))
+            readable[indices] = True
+    return hashes, readable
+
+def scan_dataset(dataset_dir):
+    """Relative paths ('class/file.jpg'), sizes and mtimes of every image"""
+    entries = []
+    for class_name in sorted(os.listdir(dataset_dir)):
+        class_dir = os.path.join(dataset_dir, class_name)
+        if not os.path.isdir(class_dir):
+            continue
+        for name in sorted(os.listdir(class_dir)):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                stat = os.stat(os.path.join(class_dir, name))
+                entries.append((f"{class_name}/{name}", stat.st_size, stat.st_mtime_ns))
+    return entries
+
+def _npz_path(index_path):
+    # np.savez appends .npz unless it is already there, so load from the same name
+    return index_path if index_path.endswith('.npz') else index_path + '.npz'
+
+class PHashIndex:
+    """On-disk dHash index of a dataset directory"""
+
+    def __init__(self, paths=None, sizes=None, mtimes=None, hashes=None):
+        self.paths = list(paths) if paths is not None else []
+        self.sizes = np.asarray(sizes if sizes is not None else [], dtype=np.int64)
+        self.mtimes = np.asarray(mtimes if mtimes is not None else [], dtype=np.int64)
+        self.hashes = np.asarray(hashes if hashes is not None else [], dtype=np.uint64)
+
+    @classmethod
+    def load(cls, index_path):
+        index_path = _npz_path(index_path)
+        if not os.path.exists(index_path):
+            return cls()
+        data = np.load(index_path, allow_pickle=False)
+        return cls(data["paths"].tolist(), data["sizes"], data["mtimes"], data["hashes"])
+
+    def save(self, index_path):
+        index_path = _npz_path(index_path)
+        os.makedirs(os.path.dirname(os.path.abspath(index_path)), exist_ok=True)
+        np.savez(index_path, paths=np.array(self.paths, dtype=str), sizes=self.sizes,
+                 mtimes=self.mtimes, hashes=self.hashes)
+
+    def update(self, dataset_dir):
+        """Hash new or modified images and drop deleted ones; returns the number hashed"""
+        known = {path: i for i, path in enumerate(self.paths)}
+        entries = scan_dataset(dataset_dir)
+        hashes = np.zeros(len(entries), dtype=np.uint64)
+        keep = np.ones(len(entries), dtype=bool)
+        stale = []
+        for i, (path, size, mtime) in enumerate(entries):
+            j = known.get(path)
+            if j is not None and self.sizes[j] == size and self.mtimes[j] == mtime:
+                hashes[i] = self.hashes[j]
+            else:
+                stale.append(i)
+
+        if stale:
+            new_hashes, readable = compute_hashes(
+                [os.path.join(dataset_dir, entries[i][0]) for i in stale])
+            hashes[stale] = new_hashes
+            for i, ok in zip(stale, readable):
+                if not ok:
+                    print(f"Warning: Could not read {entries[i][0]}, leaving it out of the index")
+                    keep[i] = False
+
+        self.paths = [entry[0] for entry, k in zip(entries, keep) if k]
+        self.sizes = np.array([entry[1] for entry in entries], dtype=np.int64)[keep]
+        self.mtimes = np.array([entry[2] for entry in entries], dtype=np.int64)[keep]
+        self.hashes = hashes[keep]
+        return len(stale)
+
+    def query(self, image_hash, max_distance=DEFAULT_MAX_DISTANCE):
+        """Indices and distances of indexed images within `max_distance` of a hash"""
+        distances = hamming_distance(self.hashes, np.uint64(image_hash))
+        matches = np.nonzero(distances <= max_distance)[0]
+        return matches, distances[matches]
+
+    def near_duplicate_pairs(self, max_distance=DEFAULT_MAX_DISTANCE):
+        """All pairs (i, j, distance) with i < j and distance <= max_distance
+
+        Multi-index hashing: the 64 bits are split into max_distance + 1 bands,
+        and any pair within max_distance must agree exactly on at least one
+        band (pigeonhole), so only those candidates are compared.
+        """
+        n = len(self.hashes)
+        if n < 2:
+            return np.empty((0, 3), dtype=np.int64)
+        bands = min(max_distance + 1, 64)
+        bounds = np.linspace(0, 64, bands + 1).astype(int)
+
+        candidates = []
+        for low, high in zip(bounds[:-1], bounds[1:]):
+            mask = np.uint64((1 << (high - low)) - 1)
+            keys = (self.hashes >> np.uint64(low)) & mask
+            order = np.argsort(keys, kind='stable')
+            sorted_keys = keys[order]
+            # Runs of equal band values are candidate groups
+            starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+            ends = np.r_[starts[1:], n]
+            for start, end in zip(starts, ends):
+                if end - start < 2:
+                    continue
+                members = order[start:end]
+                i, j = np.triu_indices(len(members), k=1)
+                candidates.append(np.stack([members[i], members[j]], axis=1))
+
+        if not candidates:
+            return np.empty((0, 3), dtype=np.int64)
+        pairs = np.concatenate(candidates)
+        pairs = np.unique(np.sort(pairs, axis=1), axis=0)
+        distances = hamming_distance(self.hashes[pairs[:, 0]], self.hashes[pairs[:, 1]])
+        close = distances <= max_distance
+        return np.column_stack([pairs[close], distances[close]])
+
+    def clusters(self, max_distance=DEFAULT_MAX_DISTANCE):
+        """Cluster id per image; near-duplicates (transitively) share an id"""
+        parent = np.arange(len(self.hashes))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for i, j, _ in self.near_duplicate_pairs(max_distance):
+            root_i, root_j = find(i), find(j)
+            if root_i != root_j:
+                parent[max(root_i, root_j)] = min(root_i, root_j)
+        return np.array([find(i) for i in range(len(parent))])
+
+def duplicate_groups(dataset_dir, index_path, max_distance=DEFAULT_MAX_DISTANCE):
+    """Update the index and map each 'class/file' path to its cluster id"""
+    index = PHashIndex.load(index_path)
+    hashed = index.update(dataset_dir)
+    index.save(index_path)
+    print(f"Perceptual-hash index: {len(index.paths)} images ({hashed} newly hashed)")
+    cluster_ids = index.clusters(max_distance)
+    return {path: int(cluster) for path, cluster in zip(index.paths, cluster_ids)}
+
+def duplicate_report(groups):
+    """List clusters with more than one image, largest first"""
+    members = {}
+    for path, cluster in groups.items():
+        members.setdefault(cluster, []).append(path)
+    clusters = [sorted(paths) for paths in members.values() if len(paths) > 1]
+    clusters.sort(key=len, reverse=True)
+    return [{
+        "size": len(paths),
+        "classes": sorted({path.split('/', 1)[0] for path in paths}),
+        "images": paths,
+    } for paths in clusters]
+
+def main(argv=None):
+    """Build or update the index and report near-duplicate clusters"""
+    parser = argparse.ArgumentParser(description='Find near-duplicate images with a perceptual-hash index')
+    parser.add_argument('--input_dir', type=str, help='Dataset directory (default: raw_dataset)')
+    parser.add_argument('--index', type=str, help='Index file (default: phash_index.npz)')
+    parser.add_argument('--max_distance', type=int, default=DEFAULT_MAX_DISTANCE,
+                        help=f'Maximum Hamming distance between near-duplicates (default: {DEFAULT_MAX_DISTANCE})')
+    parser.add_argument('--report', type=str, help='Optional path to save the duplicate clusters as JSON')
+    args = parser.parse_args(argv)
+
+    PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+    input_dir = args.input_dir if args.input_dir else os.path.join(PROJECT_ROOT, "raw_dataset")
+    index_path = args.index if args.index else os.path.join(PROJECT_ROOT, "phash_index.npz")
+
+    groups = duplicate_groups(input_dir, index_path, args.max_distance)
+    clusters = duplicate_report(groups)
+    duplicates = sum(c["size"] for c in clusters)
+    print(f"Found {len(clusters)} near-duplicate clusters covering {duplicates} images")
+    for cluster in clusters[:20]:
+        print(f"- {cluster['size']} images ({', '.join(cluster['classes'])}): "
+              f"{', '.join(cluster['images'][:4])}{' ...' if cluster['size'] > 4 else ''}")
+    cross_class = [c for c in clusters if len(c["classes"]) > 1]
+    if cross_class:
+        print(f"\nWarning: {len(cross_class)} clusters span more than one class (possible label errors)")
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(clusters, f, indent=2)
+        print(f"Report saved to: {args.report}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
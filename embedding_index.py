@@ -0,0 +1,248 @@
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# Embedding index over processed_dataset/ for similarity search and hard-example
+# mining. Pooled MobileNetV2 features are L2-normalised and stored as a float16
+# memory-mapped matrix (embeddings.npy) with a JSON sidecar of paths and
+# labels, so cosine similarity is a dot product and searches stream the matrix
+# block by block instead of loading it into RAM.
+
+BATCH_SIZE = 256
+BLOCK_SIZE = 8192
+QUERY_BLOCK_SIZE = 1024
+
+def list_images(data_dir):
+    """(relative path, class index) for every .npy image, plus the class names"""
+    class_names = sorted(d for d in os.listdir(data_dir)
+                         if os.path.isdir(os.path.join(data_dir, d)))
+    entries = []
+    for class_idx, class_name in enumerate(class_names):
+        for f in sorted(os.listdir(os.path.join(data_dir, class_name))):
+            if f.endswith('.npy'):
+                entries.append((f"{class_name}/{f}", class_idx))
+    return entries, class_names
+
+def image_shape(data_dir, path):
+    """Shape of one processed image, read from the .npy header"""
+    return tuple(np.load(os.path.join(data_dir, path), mmap_mode='r').shape)
+
+def create_embedding_model(alpha=0.35, input_shape=(96, 96, 3)):
+    """MobileNetV2 feature extractor with global average pooling"""
+    import tensorflow as tf
+
+    return tf.keras.applications.MobileNetV2(
+        weights='imagenet',
+        include_top=False,
+        pooling='avg',
+        alpha=alpha,
+        input_shape=input_shape
+    )
+
+def load_batch(data_dir, paths, buffer):
+    """Load processed images into a preallocated buffer, scaled to [-1, 1]"""
+    for i, path in enumerate(paths):
+        buffer[i] = np.load(os.path.join(data_dir, path))
+    batch = buffer[:len(paths)]
+    batch *= 2.0
+    batch -= 1.0
+    return batch
+
+class EmbeddingIndex:
+    """Memory-mapped float16 embedding matrix with its path/label sidecar"""
+
+    def __init__(self, index_dir):
+        self.index_dir = index_dir
+        with open(os.path.join(index_dir, 'index.json')) as f:
+            info = json.load(f)
+        self.paths = info['paths']
+        self.labels = np.array(info['labels'], dtype=np.int32)
+        self.class_names = info['class_names']
+        self.embeddings = np.load(os.path.join(index_dir, 'embeddings.npy'), mmap_mode='r')
+
+    def __len__(self):
+        return len(self.paths)
+
+    @staticmethod
+    def build(data_dir, index_dir, alpha=0.35, batch_size=BATCH_SIZE):
+        """Embed every image in `data_dir` and write the index to `index_dir`"""
+        entries, class_names = list_images(data_dir)
+        if not entries:
+            raise ValueError(f"No .npy images found in {data_dir}")
+        paths = [path for path, _ in entries]
+
+        # Processed arrays carry the input size preprocess.py was run with
+        input_shape = image_shape(data_dir, paths[0])
+        model = create_embedding_model(alpha, input_shape)
+        dim = model.output_shape[-1]
+        os.makedirs(index_dir, exist_ok=True)
+        embeddings = np.lib.format.open_memmap(
+            os.path.join(index_dir, 'embeddings.npy'), mode='w+',
+            dtype=np.float16, shape=(len(paths), dim))
+
+        # Two buffers: the next batch is loaded from disk while the model runs
+        buffers = [np.empty((batch_size,) + input_shape, dtype=np.float32) for _ in range(2)]
+        starts = list(range(0, len(paths), batch_size))
+        with ThreadPoolExecutor(max_workers=1) as loader:
+            pending = loader.submit(load_batch, data_dir, paths[:batch_size], buffers[0])
+            for n, start in enumerate(starts):
+                batch = pending.result()
+                if n + 1 < len(starts):
+                    next_start = starts[n + 1]
+                    pending = loader.submit(load_batch, data_dir,
+                                            paths[next_start:next_start + batch_size],
+                                            buffers[(n + 1) % 2])
+                features = model(batch, training=False).numpy()
+                features /= np.maximum(np.linalg.norm(features, axis=1, keepdims=True), 1e-12)
+                embeddings[start:start + len(batch)] = features
+                print(f"\rEmbedded {start + len(batch)}/{len(paths)}", end="")
+        print()
+        embeddings.flush()
+        del embeddings
+
+        with open(os.path.join(index_dir, 'index.json'), 'w') as f:
+            json.dump({
+                'paths': paths,
+                'labels': [label for _, label in entries],
+                'class_names': class_names,
+                'alpha': alpha,
+                'input_shape': list(input_shape),
+            }, f)
+        print(f"Embedding index saved to: {index_dir} ({len(paths)} x {dim}, float16)")
+
+    def knn(self, queries, k=10, exclude=None, block_size=BLOCK_SIZE):
+        """Top-k cosine neighbours of normalised `queries` [Q, D]
+
+        The matrix is scanned in blocks and a running top-k is kept per query.
+        `exclude` optionally gives each query's own row index so it is skipped.
+        Returns (indices [Q, k], similarities [Q, k]), most similar first.
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        k = min(k, len(self) - (1 if exclude is not None else 0))
+        best_sims = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        best_idx = np.zeros((len(queries), k), dtype=np.int64)
+        rows = np.arange(len(queries))
+
+        for start in range(0, len(self), block_size):
+            block = np.asarray(self.embeddings[start:start + block_size], dtype=np.float32)
+            sims = queries @ block.T
+            if exclude is not None:
+                local = exclude - start
+                inside = (local >= 0) & (local < len(block))
+                sims[rows[inside], local[inside]] = -np.inf
+
+            # Merge the block into the running top-k
+            sims = np.concatenate([best_sims, sims], axis=1)
+            idx = np.concatenate([best_idx, np.broadcast_to(
+                np.arange(start, start + len(block)), (len(queries), len(block)))], axis=1)
+            top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+            best_sims = np.take_along_axis(sims, top, axis=1)
+            best_idx = np.take_along_axis(idx, top, axis=1)
+
+        order = np.argsort(-best_sims, axis=1)
+        return np.take_along_axis(best_idx, order, axis=1), np.take_along_axis(best_sims, order, axis=1)
+
+    def all_neighbours(self, k=10, query_block_size=QUERY_BLOCK_SIZE):
+        """kNN of every indexed image against the rest, computed a query block at a time"""
+        # Each image has at most len - 1 other images to rank
+        k = min(k, len(self) - 1)
+        if k < 1:
+            raise ValueError("Need at least two indexed images to find neighbours")
+        indices = np.zeros((len(self), k), dtype=np.int64)
+        sims = np.zeros((len(self), k), dtype=np.float32)
+        for start in range(0, len(self), query_block_size):
+            stop = min(start + query_block_size, len(self))
+            queries = np.asarray(self.embeddings[start:stop], dtype=np.float32)
+            indices[start:stop], sims[start:stop] = self.knn(
+                queries, k, exclude=np.arange(start, stop))
+        return indices, sims
+
+    def hard_examples(self, k=10, top=20):
+        """Rank the hardest examples per class
+
+        Hardness is the fraction of an image's k nearest neighbours that carry a
+        different label, ties broken by similarity to the closest other-class
+        neighbour. High scores are likely mislabels or confusable leaves.
+        """
+        indices, sims = self.all_neighbours(k)
+        neighbour_labels = self.labels[indices]
+        disagree = neighbour_labels != self.labels[:, None]
+        hardness = disagree.mean(axis=1)
+        closest_other = np.where(disagree, sims, -np.inf).max(axis=1)
+
+        report = {}
+        for class_idx, class_name in enumerate(self.class_names):
+            members = np.flatnonzero(self.labels == class_idx)
+            order = np.lexsort((-closest_other[members], -hardness[members]))
+            ranked = []
+            for i in members[order[:top]]:
+                if hardness[i] == 0:
+                    break
+                other = neighbour_labels[i][disagree[i]]
+                ranked.append({
+                    'path': self.paths[i],
+                    'hardness': float(hardness[i]),
+                    'confused_with': self.class_names[int(np.bincount(other).argmax())],
+                    'closest_other_similarity': float(closest_other[i]),
+                })
+            report[class_name] = ranked
+        return report
+
+def main(argv=None):
+    """Build the index, query neighbours or rank hard examples"""
+    parser = argparse.ArgumentParser(description='Embedding index for similarity search and hard-example mining')
+    parser.add_argument('--build', action='store_true', help='(Re)build the index from the processed dataset')
+    parser.add_argument('--data_dir', type=str, help='Processed dataset directory (default: processed_dataset)')
+    parser.add_argument('--index_dir', type=str, help='Index directory (default: embedding_index)')
+    parser.add_argument('--alpha', type=float, default=0.35, help='MobileNetV2 width multiplier (default: 0.35)')
+    parser.add_argument('--batch_size', type=int, default=BATCH_SIZE,
+                        help=f'Images embedded per batch (default: {BATCH_SIZE})')
+    parser.add_argument('--query', type=str, help="Indexed image (e.g. 'late_blight_leaf/Lb1.npy') to find neighbours of")
+    parser.add_argument('--k', type=int, default=10, help='Number of neighbours (default: 10)')
+    parser.add_argument('--hard_examples', type=int, metavar='N',
+                        help='Rank the N hardest examples per class')
+    parser.add_argument('--report', type=str, help='Optional path to save the hard-example ranking as JSON')
+    args = parser.parse_args(argv)
+
+    PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+    data_dir = args.data_dir if args.data_dir else os.path.join(PROJECT_ROOT, "processed_dataset")
+    index_dir = args.index_dir if args.index_dir else os.path.join(PROJECT_ROOT, "embedding_index")
+
+    if not (args.build or args.query or args.hard_examples):
+        parser.print_help()
+        return 1
+
+    if args.build:
+        EmbeddingIndex.build(data_dir, index_dir, args.alpha, args.batch_size)
+
+    index = EmbeddingIndex(index_dir)
+
+    if args.query:
+        if args.query not in index.paths:
+            print(f"Error: {args.query} is not in the index")
+            return 1
+        row = index.paths.index(args.query)
+        query = np.asarray(index.embeddings[row:row + 1], dtype=np.float32)
+        indices, sims = index.knn(query, args.k, exclude=np.array([row]))
+        print(f"\nNearest neighbours of {args.query} ({index.class_names[index.labels[row]]}):")
+        for i, sim in zip(indices[0], sims[0]):
+            print(f"- {sim:.3f}  {index.paths[i]}")
+
+    if args.hard_examples:
+        report = index.hard_examples(args.k, args.hard_examples)
+        for class_name, ranked in report.items():
+            print(f"\n{class_name}: {len(ranked)} hard examples")
+            for item in ranked:
+                print(f"- {item['hardness']:.2f}  {item['path']} (confused with {item['confused_with']})")
+        if args.report:
+            with open(args.report, 'w') as f:
+                json.dump(report, f, indent=2)
+            print(f"\nReport saved to: {args.report}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
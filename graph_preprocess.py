@@ -0,0 +1,166 @@
+import numpy as np
+import tensorflow as tf
+
+# TensorFlow port of preprocess.preprocess_image so the exported model can take
+# encoded image bytes and preprocess them inside the graph, batched.
+# Colour conversions follow OpenCV's 8-bit RGB<->Lab conventions and CLAHE
+# follows cv2.createCLAHE, so results match training to within rounding.
+
+CLIP_LIMIT = 3.0
+TILE_GRID_SIZE = (8, 8)
+
+# sRGB <-> XYZ (D65) matrices used by OpenCV
+_RGB_TO_XYZ = tf.constant([
+    [0.412453, 0.357580, 0.180423],
+    [0.212671, 0.715160, 0.072169],
+    [0.019334, 0.119193, 0.950227],
+], dtype=tf.float32)
+_XYZ_TO_RGB = tf.constant([
+    [3.240479, -1.53715, -0.498535],
+    [-0.969256, 1.875991, 0.041556],
+    [0.055648, -0.204043, 1.057311],
+], dtype=tf.float32)
+_WHITE_X = 0.950456
+_WHITE_Z = 1.088754
+
+def rgb_to_lab(rgb):
+    """Convert uint8 RGB [..., 3] to OpenCV-style 8-bit Lab (float, 0-255)"""
+    rgb = tf.cast(rgb, tf.float32) / 255.0
+    linear = tf.where(rgb <= 0.04045, rgb / 12.92, tf.pow((rgb + 0.055) / 1.055, 2.4))
+    xyz = tf.tensordot(linear, tf.transpose(_RGB_TO_XYZ), axes=1)
+    x = xyz[..., 0] / _WHITE_X
+    y = xyz[..., 1]
+    z = xyz[..., 2] / _WHITE_Z
+
+    def f(t):
+        return tf.where(t > 0.008856, tf.pow(tf.maximum(t, 1e-12), 1.0 / 3.0),
+                        7.787 * t + 16.0 / 116.0)
+
+    fx, fy, fz = f(x), f(y), f(z)
+    l = tf.where(y > 0.008856, 116.0 * fy - 16.0, 903.3 * y)
+    a = 500.0 * (fx - fy)
+    b = 200.0 * (fy - fz)
+    lab = tf.stack([l * 255.0 / 100.0, a + 128.0, b + 128.0], axis=-1)
+    return tf.clip_by_value(tf.round(lab), 0.0, 255.0)
+
+def lab_to_rgb(lab):
+    """Convert OpenCV-style 8-bit Lab (float, 0-255) back to uint8 RGB"""
+    l = lab[..., 0] * 100.0 / 255.0
+    a = lab[..., 1] - 128.0
+    b = lab[..., 2] - 128.0
+
+    fy = tf.where(l <= 8.0, 7.787 * (l / 903.3) + 16.0 / 116.0, (l + 16.0) / 116.0)
+    y = tf.where(l <= 8.0, l / 903.3, tf.pow(fy, 3.0))
+    fx = a / 500.0 + fy
+    fz = fy - b / 200.0
+
+    def f_inv(t):
+        return tf.where(t > 0.206893, tf.pow(t, 3.0), (t - 16.0 / 116.0) / 7.787)
+
+    xyz = tf.stack([f_inv(fx) * _WHITE_X, y, f_inv(fz) * _WHITE_Z], axis=-1)
+    linear = tf.clip_by_value(tf.tensordot(xyz, tf.transpose(_XYZ_TO_RGB), axes=1), 0.0, 1.0)
+    rgb = tf.where(linear <= 0.0031308, 12.92 * linear,
+                   1.055 * tf.pow(tf.maximum(linear, 1e-12), 1.0 / 2.4) - 0.055)
+    return tf.cast(tf.clip_by_value(tf.round(rgb * 255.0), 0.0, 255.0), tf.uint8)
+
+def _interpolation_weights(size, tile_size, tiles):
+    """Per-pixel neighbouring tile indices and weights, as in cv2's CLAHE"""
+    pos = np.arange(size, dtype=np.float32) / tile_size - 0.5
+    t1 = np.floor(pos).astype(np.int32)
+    weight = (pos - t1).astype(np.float32)
+    t2 = np.minimum(t1 + 1, tiles - 1)
+    t1 = np.maximum(t1, 0)
+    return t1, t2, weight
+
+def clahe(channel, clip_limit=CLIP_LIMIT, tile_grid_size=TILE_GRID_SIZE):
+    """Batched CLAHE on a [batch, height, width] 8-bit channel (float values)
+
+    Height and width must be known statically. When they are not multiples
+    of the tile grid the image is padded like cv2 does: the tile histograms
+    come from a reflect-101 padded copy, the lookup is applied to the
+    original pixels.
+    """
+    tiles_y, tiles_x = tile_grid_size
+    height, width = channel.shape[1], channel.shape[2]
+    values = tf.cast(channel, tf.int32)
+    batch = tf.shape(values)[0]
+
+    padded = values
+    if height % tiles_y or width % tiles_x:
+        # cv2 pads both dimensions by (tiles - size % tiles), even a divisible one
+        padded = tf.pad(values, [[0, 0], [0, tiles_y - height % tiles_y], [0, tiles_x - width % tiles_x]],
+                        mode='REFLECT')
+    tile_h, tile_w = padded.shape[1] // tiles_y, padded.shape[2] // tiles_x
+    tile_area = tile_h * tile_w
+    num_tiles = tiles_y * tiles_x
+
+    # Histogram of every tile in the batch with a single bincount
+    tiled = tf.reshape(padded, [batch, tiles_y, tile_h, tiles_x, tile_w])
+    tiled = tf.reshape(tf.transpose(tiled, [0, 1, 3, 2, 4]), [batch, num_tiles, tile_area])
+    offsets = tf.reshape(tf.range(batch * num_tiles) * 256, [batch, num_tiles, 1])
+    hist = tf.math.bincount(tf.reshape(tiled + offsets, [-1]),
+                            minlength=batch * num_tiles * 256,
+                            maxlength=batch * num_tiles * 256)
+    hist = tf.reshape(hist, [batch, num_tiles, 256])
+
+    # Clip the histogram and redistribute the excess like OpenCV
+    clip = max(int(clip_limit * tile_area / 256), 1)
+    excess = tf.reduce_sum(tf.maximum(hist - clip, 0), axis=-1, keepdims=True)
+    hist = tf.minimum(hist, clip) + excess // 256
+    residual = excess - (excess // 256) * 256
+    step = tf.maximum(256 // tf.maximum(residual, 1), 1)
+    bins = tf.range(256)
+    hist += tf.cast((bins % step == 0) & (bins // step < residual), tf.int32)
+
+    # Lookup table per tile
+    lut = tf.cumsum(tf.cast(hist, tf.float32), axis=-1) * (255.0 / tile_area)
+    lut = tf.clip_by_value(tf.round(lut), 0.0, 255.0)
+    lut = tf.reshape(lut, [batch, num_tiles * 256])
+
+    # Bilinear blend of the four neighbouring tile mappings
+    y1, y2, wy = _interpolation_weights(height, tile_h, tiles_y)
+    x1, x2, wx = _interpolation_weights(width, tile_w, tiles_x)
+    wy = tf.constant(wy)[:, None]
+    wx = tf.constant(wx)[None, :]
+
+    def mapped(ty, tx):
+        tile_index = tf.constant(ty[:, None] * tiles_x + tx[None, :])
+        index = tile_index[None] * 256 + values
+        return tf.gather(lut, tf.reshape(index, [batch, -1]), batch_dims=1)
+
+    top = tf.reshape(mapped(y1, x1), [batch, height, width]) * (1 - wx) + \
+        tf.reshape(mapped(y1, x2), [batch, height, width]) * wx
+    bottom = tf.reshape(mapped(y2, x1), [batch, height, width]) * (1 - wx) + \
+        tf.reshape(mapped(y2, x2), [batch, height, width]) * wx
+    result = top * (1 - wy) + bottom * wy
+    return tf.clip_by_value(tf.round(result), 0.0, 255.0)
+
+def enhance_contrast(images):
+    """Batched equivalent of the CLAHE-on-L step in preprocess_image (uint8 in/out)"""
+    lab = rgb_to_lab(images)
+    l = clahe(lab[..., 0])
+    return lab_to_rgb(tf.stack([l, lab[..., 1], lab[..., 2]], axis=-1))
+
+def decode_and_resize(image_bytes, target_size=(96, 96)):
+    """Decode one encoded image to uint8 RGB and resize like cv2.INTER_LINEAR
+
+    Unlike cv2.imread in training and decode_image in cloud/main.py, the
+    graph decoder ignores the EXIF orientation tag, so photos stored
+    sideways with a rotation tag are classified as stored.
+    """
+    img = tf.io.decode_image(image_bytes, channels=3, expand_animations=False)
+    img = tf.image.resize(img, target_size, method='bilinear')
+    img = tf.cast(tf.clip_by_value(tf.round(img), 0.0, 255.0), tf.uint8)
+    img.set_shape(list(target_size) + [3])
+    return img
+
+def preprocess_image_bytes(image_bytes, target_size=(96, 96)):
+    """Decode, resize, contrast-enhance and normalize a batch of encoded images"""
+    images = tf.map_fn(
+        lambda b: decode_and_resize(b, target_size),
+        image_bytes,
+        fn_output_signature=tf.TensorSpec(list(target_size) + [3], tf.uint8),
+        parallel_iterations=16
+    )
+    images = enhance_contrast(images)
+    return tf.cast(images, tf.float32) / 255.0
@@ -1,8 +1,12 @@
 import os
+import sys
+import glob
+import json
+import math
 import shutil
+import argparse
 import cv2
 import numpy as np
-from sklearn.model_selection import train_test_split
 
 # Update expected classes to match current folder structure
 EXPECTED_CLASSES = [
@@ -33,16 +37,18 @@ def verify_dataset_structure(source_dir):
         
     return True
 
-def preprocess_image(image_path):
+def preprocess_image(image_path, target_size=(96, 96)):
     """Preprocess single image before dataset split"""
     # Read image
     img = cv2.imread(image_path)
+    if img is None:
+        return None
     
     # Convert to RGB (from BGR)
     img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
     
     # Resize to target size
-    img = cv2.resize(img, (96, 96))  # Standardize to 96x96
+    img = cv2.resize(img, target_size)  # Standardize to the model input size
     
     # Optional: Apply histogram equalization
     lab = cv2.cvtColor(img, cv2.COLOR_RGB2LAB)
@@ -54,40 +60,124 @@ def preprocess_image(image_path):
     
     return img
 
-def organize_dataset(source_dir, output_dir, validation_split=0.2):
+def assign_shared_clusters(class_files, groups, validation_split):
+    """Pick one side of the split for every near-duplicate cluster that spans several classes
+
+    Returns {'class/file': split} for the members of those clusters, so each
+    of them lands wholly in train or wholly in validation.
     """
-    Organize dataset into train and validation sets
+    from sklearn.model_selection import train_test_split
+
+    cluster_classes = {}
+    for disease, image_files in class_files.items():
+        for f in image_files:
+            cluster = groups.get(f"{disease}/{f}")
+            if cluster is not None:
+                cluster_classes.setdefault(cluster, set()).add(disease)
+    shared = sorted(cluster for cluster, classes in cluster_classes.items() if len(classes) > 1)
+    if not shared:
+        return {}
+
+    if len(shared) < 2:
+        train_ids, valid_ids = shared, []
+    else:
+        train_ids, valid_ids = train_test_split(shared, test_size=validation_split, random_state=42)
+    side = dict.fromkeys(train_ids, 'train')
+    side.update(dict.fromkeys(valid_ids, 'validation'))
+    print(f"{len(shared)} near-duplicate clusters span several classes; each is kept on one side of the split")
+    return {f"{disease}/{f}": side[groups[f"{disease}/{f}"]]
+            for disease, image_files in class_files.items() for f in image_files
+            if groups.get(f"{disease}/{f}") in side}
+
+def split_by_cluster(disease, image_files, groups, validation_split, assigned=None):
+    """Split whole near-duplicate clusters so no cluster straddles train and validation
+
+    `assigned` fixes the side of files whose cluster spans several classes
+    (see assign_shared_clusters); the remaining clusters are split here.
     """
-    # Create main directories
-    train_dir = os.path.join(output_dir, 'train')
-    valid_dir = os.path.join(output_dir, 'validation')
-    os.makedirs(train_dir, exist_ok=True)
-    os.makedirs(valid_dir, exist_ok=True)
+    from sklearn.model_selection import train_test_split
 
-    # Get all disease classes
-    disease_classes = [d for d in os.listdir(source_dir) 
-                      if os.path.isdir(os.path.join(source_dir, d))]
+    assigned = assigned or {}
+    fixed_train = [f for f in image_files if assigned.get(f"{disease}/{f}") == 'train']
+    fixed_valid = [f for f in image_files if assigned.get(f"{disease}/{f}") == 'validation']
+    free_files = [f for f in image_files if f"{disease}/{f}" not in assigned]
 
-    total_files = 0
-    processed_files = 0
-    
-    # Count total files first
-    for disease in disease_classes:
-        image_files = [f for f in os.listdir(os.path.join(source_dir, disease))
-                      if f.endswith(('.jpg', '.jpeg', '.png'))]
-        total_files += len(image_files)
-    
-    print(f"Found {total_files} images in {len(disease_classes)} classes")
+    clusters = {}
+    for f in free_files:
+        # Files missing from the index (e.g. unreadable) form their own cluster
+        clusters.setdefault(groups.get(f"{disease}/{f}", f), []).append(f)
+    cluster_ids = sorted(clusters, key=str)
+    if len(free_files) < 2:
+        return fixed_train + free_files, fixed_valid
+    if len(cluster_ids) < 2:
+        print(f"Warning: {disease} is a single near-duplicate cluster, splitting by filename")
+        train_files, valid_files = train_test_split(free_files, test_size=validation_split, random_state=42)
+        return fixed_train + train_files, fixed_valid + valid_files
+
+    train_ids, valid_ids = train_test_split(
+        cluster_ids,
+        test_size=validation_split,
+        random_state=42
+    )
+    train_files = [f for cid in train_ids for f in clusters[cid]]
+    valid_files = [f for cid in valid_ids for f in clusters[cid]]
+    print(f"- {len(cluster_ids)} clusters ({len(free_files) - len(cluster_ids)} near-duplicates kept together)")
+    return fixed_train + train_files, fixed_valid + valid_files
+
+class TFRecordShardWriter:
+    """Spread one split's examples round-robin over equally sized TFRecord shards
+
+    Each example holds the preprocessed uint8 pixels and the class index, so
+    every example has the same size and round-robin keeps shards balanced.
+    """
+
+    def __init__(self, directory, split, num_examples, example_bytes, shard_size_mb=64):
+        import tensorflow as tf
+        self._tf = tf
+        self.num_shards = max(1, math.ceil(num_examples * example_bytes / (shard_size_mb * 1024 * 1024)))
+        os.makedirs(directory, exist_ok=True)
+        # Drop shards from an earlier run, which may have used a different count
+        for old_shard in glob.glob(os.path.join(directory, f"{split}-*.tfrecord")):
+            os.remove(old_shard)
+        self.writers = [
+            tf.io.TFRecordWriter(os.path.join(directory, f"{split}-{i:05d}-of-{self.num_shards:05d}.tfrecord"))
+            for i in range(self.num_shards)
+        ]
+        self.count = 0
+
+    def write(self, image, label):
+        tf = self._tf
+        example = tf.train.Example(features=tf.train.Features(feature={
+            'image': tf.train.Feature(bytes_list=tf.train.BytesList(value=[image.tobytes()])),
+            'label': tf.train.Feature(int64_list=tf.train.Int64List(value=[label])),
+        }))
+        self.writers[self.count % self.num_shards].write(example.SerializeToString())
+        self.count += 1
+
+    def close(self):
+        for writer in self.writers:
+            writer.close()
+
+def plan_split(source_dir, validation_split=0.2, groups=None):
+    """Scan every class folder once and decide where each image goes
+
+    Returns the sorted class names and a list of (split, disease, filename).
+    """
+    # Imported here so importing this module stays cheap
+    from sklearn.model_selection import train_test_split
     
+    disease_classes = sorted(d for d in os.listdir(source_dir)
+                             if os.path.isdir(os.path.join(source_dir, d)))
+    class_files = {
+        disease: sorted(f for f in os.listdir(os.path.join(source_dir, disease))
+                        if f.lower().endswith(('.jpg', '.jpeg', '.png')))
+        for disease in disease_classes
+    }
+    # Clusters shared between classes are placed before the per-class split
+    assigned = assign_shared_clusters(class_files, groups, validation_split) if groups is not None else {}
+    plan = []
     for disease in disease_classes:
-        print(f"\nProcessing {disease}...")
-        # Create disease directories in train and validation
-        os.makedirs(os.path.join(train_dir, disease), exist_ok=True)
-        os.makedirs(os.path.join(valid_dir, disease), exist_ok=True)
-
-        # Get all images for this disease
-        image_files = [f for f in os.listdir(os.path.join(source_dir, disease))
-                      if f.endswith(('.jpg', '.jpeg', '.png'))]
+        image_files = class_files[disease]
         
         # Handle small datasets
         if len(image_files) < 2:
@@ -95,6 +185,8 @@ def organize_dataset(source_dir, output_dir, validation_split=0.2):
             print("Copying same image to both train and validation sets")
             train_files = image_files
             valid_files = image_files
+        elif groups is not None:
+            train_files, valid_files = split_by_cluster(disease, image_files, groups, validation_split, assigned)
         else:
             # Split into train and validation
             train_files, valid_files = train_test_split(
@@ -102,46 +194,161 @@ def organize_dataset(source_dir, output_dir, validation_split=0.2):
                 test_size=validation_split,
                 random_state=42
             )
-
-        print(f"- Found {len(image_files)} images")
-        print(f"- Training: {len(train_files)}, Validation: {len(valid_files)}")
         
-        # Copy files to respective directories
-        for f in train_files:
-            # Preprocess before copying
-            img_path = os.path.join(source_dir, disease, f)
-            processed_img = preprocess_image(img_path)
-            output_path = os.path.join(train_dir, disease, f)
-            cv2.imwrite(output_path, cv2.cvtColor(processed_img, cv2.COLOR_RGB2BGR))
-            processed_files += 1
-            print(f"\rProgress: {processed_files}/{total_files}", end="")
-            
-        for f in valid_files:
-            # Also preprocess validation images
-            img_path = os.path.join(source_dir, disease, f)
-            processed_img = preprocess_image(img_path)
-            output_path = os.path.join(valid_dir, disease, f)
-            cv2.imwrite(output_path, cv2.cvtColor(processed_img, cv2.COLOR_RGB2BGR))
-            processed_files += 1
-            print(f"\rProgress: {processed_files}/{total_files}", end="")
+        print(f"{disease}: {len(image_files)} images -> Training: {len(train_files)}, Validation: {len(valid_files)}")
+        plan.extend(('train', disease, f) for f in train_files)
+        plan.extend(('validation', disease, f) for f in valid_files)
+    return disease_classes, plan
+
+def _process_planned_image(img_path, output_path, target_size, keep_pixels):
+    """Worker: preprocess one image and write its JPEG; returns (pixels, error)"""
+    try:
+        processed_img = preprocess_image(img_path, target_size)
+    except cv2.error as e:
+        return None, f"preprocessing failed: {str(e).strip()}"
+    if processed_img is None:
+        return None, "unreadable or corrupt image"
+    if output_path and not cv2.imwrite(output_path, cv2.cvtColor(processed_img, cv2.COLOR_RGB2BGR)):
+        return None, f"could not write {output_path}"
+    return (processed_img if keep_pixels else None), None
+
+def default_workers():
+    """Use the core budget run_workflow.py grants this step, else every core"""
+    return int(os.environ.get('OMP_NUM_THREADS', 0)) or os.cpu_count() or 1
+
+def organize_dataset(source_dir, output_dir, validation_split=0.2, groups=None, target_size=(96, 96),
+                     output_format='jpeg', shard_size_mb=64, workers=None):
+    """
+    Organize dataset into train and validation sets
+
+    `groups` optionally maps 'class/file' paths to near-duplicate cluster ids
+    (see dedupe_dataset.py); each cluster is then kept on one side of the split.
+    `output_format` is 'jpeg' (class folders), 'tfrecord' (shards under
+    output_dir/tfrecords, read by tomato_cnn.prepare_tfrecord_dataset) or 'both'.
+    Images are processed by a pool of `workers` threads (OpenCV releases the
+    GIL); unreadable images are skipped and reported. Returns the skipped
+    (path, reason) pairs.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    
+    # Build the whole split plan with a single directory scan
+    class_names, plan = plan_split(source_dir, validation_split, groups)
+    total_files = len(plan)
+    print(f"Found {total_files} images in {len(class_names)} classes")
+    
+    # Create main directories
+    split_dirs = {
+        'train': os.path.join(output_dir, 'train'),
+        'validation': os.path.join(output_dir, 'validation'),
+    }
+    for split_dir in split_dirs.values():
+        for disease in class_names:
+            os.makedirs(os.path.join(split_dir, disease), exist_ok=True)
+    
+    write_jpeg = output_format in ('jpeg', 'both')
+    shard_writers = {}
+    if output_format in ('tfrecord', 'both'):
+        # plan_split lists each class in turn; write the records in a seeded
+        # random order so every shard (and every interleaved read) mixes classes
+        plan = [plan[i] for i in np.random.default_rng(42).permutation(len(plan))]
+        tfrecord_dir = os.path.join(output_dir, 'tfrecords')
+        example_bytes = target_size[0] * target_size[1] * 3 + 32
+        shard_writers = {
+            split: TFRecordShardWriter(tfrecord_dir, split, sum(1 for item in plan if item[0] == split),
+                                       example_bytes, shard_size_mb)
+            for split in split_dirs
+        }
+    
+    def process(item):
+        split, disease, f = item
+        output_path = os.path.join(split_dirs[split], disease, f) if write_jpeg else None
+        return _process_planned_image(os.path.join(source_dir, disease, f), output_path,
+                                      target_size, bool(shard_writers))
+    
+    workers = workers or default_workers()
+    print(f"Processing with {workers} workers...")
+    processed_files = 0
+    skipped = []
+    progress_every = max(1, total_files // 50)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # map() keeps plan order, so TFRecord shards have the same contents every run
+        for done, (item, (pixels, error)) in enumerate(zip(plan, executor.map(process, plan)), 1):
+            split, disease, f = item
+            if error:
+                skipped.append((os.path.join(source_dir, disease, f), error))
+            else:
+                processed_files += 1
+                if shard_writers:
+                    # Labels follow the sorted class names, like image_dataset_from_directory
+                    shard_writers[split].write(pixels, class_names.index(disease))
+            if done % progress_every == 0 or done == total_files:
+                print(f"\rProgress: {done}/{total_files}", end="")
+    
+    if shard_writers:
+        for writer in shard_writers.values():
+            writer.close()
+        with open(os.path.join(tfrecord_dir, 'metadata.json'), 'w') as f:
+            json.dump({
+                'classes': class_names,
+                'image_shape': [target_size[1], target_size[0], 3],
+                'counts': {split: writer.count for split, writer in shard_writers.items()},
+                'shards': {split: writer.num_shards for split, writer in shard_writers.items()},
+            }, f, indent=2)
+        print(f"\nTFRecord shards written to: {tfrecord_dir}")
     
     print("\nDataset organization completed!")
     print(f"Total images processed: {processed_files}")
+    if skipped:
+        print(f"\nSkipped {len(skipped)} images:")
+        for path, reason in skipped:
+            print(f"- {path}: {reason}")
+    return skipped
 
-if __name__ == "__main__":
-    # Use correct path to the raw_dataset directory
+def main(argv=None):
+    """Command-line entry point, also importable by run_workflow.py"""
+    parser = argparse.ArgumentParser(description='Split and preprocess the raw dataset into train/validation folders')
+    parser.add_argument('--input_dir', type=str, help='Custom raw dataset directory (default: raw_dataset)')
+    parser.add_argument('--output_dir', type=str, help='Custom output data directory (default: data)')
+    parser.add_argument('--validation_split', type=float, default=0.2,
+                        help='Fraction of images per class used for validation (default: 0.2)')
+    parser.add_argument('--img_size', type=int, default=96, help='Square model input size in pixels (default: 96)')
+    parser.add_argument('--group_duplicates', action='store_true',
+                        help='Keep near-duplicate images on the same side of the split (uses dedupe_dataset.py)')
+    parser.add_argument('--dedupe_index', type=str, help='Perceptual-hash index file (default: phash_index.npz)')
+    parser.add_argument('--max_distance', type=int, default=6,
+                        help='Maximum Hamming distance between near-duplicates (default: 6)')
+    parser.add_argument('--format', choices=['jpeg', 'tfrecord', 'both'], default='jpeg',
+                        help='Write class folders of JPEGs, TFRecord shards, or both (default: jpeg)')
+    parser.add_argument('--shard_size_mb', type=float, default=64,
+                        help='Target TFRecord shard size in MB (default: 64)')
+    parser.add_argument('--workers', type=int,
+                        help='Parallel image workers (default: OMP_NUM_THREADS or all cores)')
+    args = parser.parse_args(argv)
+    
+    # Use default or custom paths
     PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
-    SOURCE_DIR = os.path.join(PROJECT_ROOT, "raw_dataset")
-    OUTPUT_DIR = os.path.join(PROJECT_ROOT, "data")
+    SOURCE_DIR = args.input_dir if args.input_dir else os.path.join(PROJECT_ROOT, "raw_dataset")
+    OUTPUT_DIR = args.output_dir if args.output_dir else os.path.join(PROJECT_ROOT, "data")
     
     print("Verifying dataset structure...")
     if not verify_dataset_structure(SOURCE_DIR):
         print("\nRequired folder structure:")
         for class_name in EXPECTED_CLASSES:
             print(f"/raw_dataset/{class_name}/")
-        exit(1)
+        return 1
         
-    organize_dataset(SOURCE_DIR, OUTPUT_DIR)
+    groups = None
+    if args.group_duplicates:
+        from dedupe_dataset import duplicate_groups
+        index_path = args.dedupe_index if args.dedupe_index else os.path.join(PROJECT_ROOT, "phash_index.npz")
+        groups = duplicate_groups(SOURCE_DIR, index_path, args.max_distance)
+
+    organize_dataset(SOURCE_DIR, OUTPUT_DIR, args.validation_split, groups, (args.img_size, args.img_size),
+                     args.format, args.shard_size_mb, args.workers)
     print(f"Dataset organized successfully!")
     print(f"Source: {SOURCE_DIR}")
     print(f"Output: {OUTPUT_DIR}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
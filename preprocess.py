@@ -1,6 +1,8 @@
 import cv2
 import numpy as np
 import os
+import sys
+import argparse
 
 def check_dataset(input_dir):
     """Check if dataset exists and contains images"""
@@ -44,23 +46,31 @@ def preprocess_image(image_path, target_size=(96, 96)):
     # Convert to RGB
     img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
     
+    return preprocess_rgb(img, target_size)
+
+def preprocess_rgb(img, target_size=(96, 96)):
+    """Resize, contrast-enhance and normalize an already decoded RGB image"""
     # Resize
     img = cv2.resize(img, target_size)
     
+    img = enhance_contrast(img)
+    
+    # Normalize
+    img = img.astype('float32') / 255.0
+    
+    return img
+
+def enhance_contrast(img):
+    """CLAHE on the L channel of a uint8 RGB image"""
     # Enhance contrast using CLAHE
     lab = cv2.cvtColor(img, cv2.COLOR_RGB2LAB)
     l, a, b = cv2.split(lab)
     clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8,8))
     cl = clahe.apply(l)
     enhanced = cv2.merge((cl,a,b))
-    img = cv2.cvtColor(enhanced, cv2.COLOR_LAB2RGB)
-    
-    # Normalize
-    img = img.astype('float32') / 255.0
-    
-    return img
+    return cv2.cvtColor(enhanced, cv2.COLOR_LAB2RGB)
 
-def process_dataset(input_dir, output_dir):
+def process_dataset(input_dir, output_dir, target_size=(96, 96)):
     """Process entire dataset"""
     for class_name in os.listdir(input_dir):
         class_path = os.path.join(input_dir, class_name)
@@ -81,21 +91,32 @@ def process_dataset(input_dir, output_dir):
                                      os.path.splitext(img_name)[0] + '.npy')
             
             # Preprocess and save as numpy array
-            processed_img = preprocess_image(input_path)
+            processed_img = preprocess_image(input_path, target_size)
             if processed_img is not None:
                 np.save(output_path, processed_img)
 
-if __name__ == "__main__":
-    # Use correct path to the raw_dataset directory
+def main(argv=None):
+    """Command-line entry point, also importable by run_workflow.py"""
+    parser = argparse.ArgumentParser(description='Preprocess tomato disease images into normalized .npy arrays')
+    parser.add_argument('--input_dir', type=str, help='Custom raw dataset directory (default: raw_dataset)')
+    parser.add_argument('--output_dir', type=str, help='Custom output directory (default: processed_dataset)')
+    parser.add_argument('--img_size', type=int, default=96, help='Square model input size in pixels (default: 96)')
+    args = parser.parse_args(argv)
+    
+    # Use default or custom paths
     PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
-    raw_dir = os.path.join(PROJECT_ROOT, "raw_dataset")
-    processed_dir = os.path.join(PROJECT_ROOT, "processed_dataset")
+    raw_dir = args.input_dir if args.input_dir else os.path.join(PROJECT_ROOT, "raw_dataset")
+    processed_dir = args.output_dir if args.output_dir else os.path.join(PROJECT_ROOT, "processed_dataset")
     
     print(f"Looking for dataset in: {raw_dir}")
     print("Checking dataset structure...")
     if not check_dataset(raw_dir):
-        exit(1)
+        return 1
     
     print("\nStarting preprocessing...")
     os.makedirs(processed_dir, exist_ok=True)
-    process_dataset(raw_dir, processed_dir)
+    process_dataset(raw_dir, processed_dir, (args.img_size, args.img_size))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
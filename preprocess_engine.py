@@ -0,0 +1,232 @@
+import argparse
+import os
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from preprocess import enhance_contrast
+from prepare_dataset import EXPECTED_CLASSES, plan_split, verify_dataset_structure, default_workers
+from calibration_set import DEFAULT_PER_CLASS, DEFAULT_SEED, build_calibration_set
+
+# Single-pass preprocessing engine for the offline stages. Every raw image is
+# decoded and resized once, contrast-enhanced once, and the result is pushed
+# through a set of sinks that write what preprocess.py (.npy arrays),
+# prepare_dataset.py (train/validation JPEGs) and augment_dataset.py (augmented
+# JPEGs) would otherwise each produce from their own pass over raw_dataset/.
+# The int8 calibration cache (calibration_set.py) is refreshed at the end from
+# the data/train just written, without touching the raw photos again.
+#
+# Sinks with `parallel = True` run in the decode workers; the others run in
+# the main thread in dataset order, which keeps their output deterministic.
+
+# `resized` is the uint8 RGB image at the target size, `enhanced` the same
+# image after CLAHE (the pixels preprocess.py and prepare_dataset.py store)
+SourceImage = namedtuple('SourceImage', ['class_name', 'filename', 'resized', 'enhanced'])
+
+class ArraySink:
+    """Normalized float32 .npy per image, as preprocess.py writes them"""
+    parallel = True
+
+    def __init__(self, output_dir, class_names):
+        self.output_dir = output_dir
+        for class_name in class_names:
+            os.makedirs(os.path.join(output_dir, class_name), exist_ok=True)
+
+    def consume(self, item):
+        output_path = os.path.join(self.output_dir, item.class_name,
+                                   os.path.splitext(item.filename)[0] + '.npy')
+        np.save(output_path, item.enhanced.astype('float32') / 255.0)
+
+    def close(self):
+        pass
+
+class SplitJpegSink:
+    """Contrast-enhanced JPEGs in train/ and validation/ class folders, as prepare_dataset.py writes them"""
+    parallel = True
+
+    def __init__(self, output_dir, class_names, plan):
+        self.output_dir = output_dir
+        self.splits = {}
+        for split, class_name, filename in plan:
+            self.splits.setdefault((class_name, filename), []).append(split)
+        for split in ('train', 'validation'):
+            for class_name in class_names:
+                os.makedirs(os.path.join(output_dir, split, class_name), exist_ok=True)
+
+    def consume(self, item):
+        bgr = cv2.cvtColor(item.enhanced, cv2.COLOR_RGB2BGR)
+        for split in self.splits.get((item.class_name, item.filename), ()):
+            cv2.imwrite(os.path.join(self.output_dir, split, item.class_name, item.filename), bgr)
+
+    def close(self):
+        pass
+
+class AugmentationSink:
+    """Resized originals plus augmented JPEGs, as augment_dataset.py writes them"""
+    parallel = False
+
+    def __init__(self, output_dir, class_names, samples_per_image=3):
+        from augment_dataset import create_augmentation_layer
+        self.output_dir = output_dir
+        self.samples_per_image = samples_per_image
+        self.augmentation_layer = create_augmentation_layer()
+        for class_name in class_names:
+            os.makedirs(os.path.join(output_dir, class_name), exist_ok=True)
+
+    def consume(self, item):
+        from augment_dataset import augment_image
+        augment_image(self.augmentation_layer, item.resized, os.path.join(self.output_dir, item.class_name),
+                      item.filename, self.samples_per_image)
+
+    def close(self):
+        pass
+
+class CalibrationSink:
+    """Refresh the int8 calibration cache once the train/validation JPEGs are written
+
+    The sample is drawn by calibration_set.build_calibration_set from data/train
+    as it is on disk, so the cached images, their order and their (JPEG-decoded)
+    pixels are exactly what tomato_cnn.py would build itself. Only the sampled
+    images are decoded, at the model input size.
+    """
+    parallel = False
+
+    def __init__(self, data_dir, target_size, per_class=DEFAULT_PER_CLASS, seed=DEFAULT_SEED, diverse=False):
+        self.data_dir = data_dir
+        self.target_size = target_size
+        self.per_class = per_class
+        self.seed = seed
+        self.diverse = diverse
+
+    def consume(self, item):
+        pass
+
+    def close(self):
+        build_calibration_set(self.data_dir, self.per_class, self.target_size, self.seed, self.diverse)
+
+def decode_source(source_dir, class_name, filename, target_size):
+    """The one decode per image: read, convert to RGB, resize and contrast-enhance"""
+    img = cv2.imread(os.path.join(source_dir, class_name, filename))
+    if img is None:
+        return None
+    resized = cv2.resize(cv2.cvtColor(img, cv2.COLOR_BGR2RGB), target_size)
+    return SourceImage(class_name, filename, resized, enhance_contrast(resized))
+
+def run_engine(source_dir, entries, sinks, target_size=(96, 96), workers=None):
+    """Decode each (class, file) entry once and feed it to every sink
+
+    Returns the (path, reason) pairs of images that were skipped.
+    """
+    parallel_sinks = [sink for sink in sinks if sink.parallel]
+    serial_sinks = [sink for sink in sinks if not sink.parallel]
+
+    def process(entry):
+        item = decode_source(source_dir, entry[0], entry[1], target_size)
+        if item is not None:
+            for sink in parallel_sinks:
+                sink.consume(item)
+        return item
+
+    workers = workers or default_workers()
+    # Bound the decoded images waiting for the serial sinks
+    chunk_size = workers * 8
+    progress_every = max(1, len(entries) // 50)
+    skipped = []
+    done = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for chunk_start in range(0, len(entries), chunk_size):
+            chunk = entries[chunk_start:chunk_start + chunk_size]
+            for entry, item in zip(chunk, executor.map(process, chunk)):
+                done += 1
+                if item is None:
+                    skipped.append((os.path.join(source_dir, *entry), "unreadable or corrupt image"))
+                else:
+                    for sink in serial_sinks:
+                        sink.consume(item)
+                if done % progress_every == 0 or done == len(entries):
+                    elapsed = time.perf_counter() - start
+                    print(f"\rProgress: {done}/{len(entries)} ({done / max(elapsed, 1e-9):.1f} images/sec)", end="")
+    print()
+
+    for sink in sinks:
+        sink.close()
+    return skipped
+
+def main(argv=None):
+    """Run the selected offline outputs from a single pass over raw_dataset"""
+    parser = argparse.ArgumentParser(description='Decode raw_dataset once and write every offline output in one pass')
+    parser.add_argument('--input_dir', type=str, help='Raw dataset directory (default: raw_dataset)')
+    parser.add_argument('--processed_dir', type=str, help='.npy output directory (default: processed_dataset)')
+    parser.add_argument('--data_dir', type=str, help='Train/validation output directory (default: data)')
+    parser.add_argument('--augmented_dir', type=str, help='Augmentation output directory (default: augmented_dataset)')
+    parser.add_argument('--img_size', type=int, default=96, help='Square model input size in pixels (default: 96)')
+    parser.add_argument('--validation_split', type=float, default=0.2,
+                        help='Fraction of images per class used for validation (default: 0.2)')
+    parser.add_argument('--no_npy', action='store_true', help='Skip the normalized .npy arrays')
+    parser.add_argument('--no_split', action='store_true', help='Skip the train/validation JPEGs')
+    parser.add_argument('--augment', action='store_true', help='Also write augmented images')
+    parser.add_argument('--samples', type=int, default=3, help='Augmented samples per image (default: 3)')
+    parser.add_argument('--no_calibration', action='store_true', help='Skip the int8 calibration cache')
+    parser.add_argument('--calibration_per_class', type=int, default=DEFAULT_PER_CLASS,
+                        help=f'Calibration images per class (default: {DEFAULT_PER_CLASS})')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED,
+                        help=f'Calibration sampling seed (default: {DEFAULT_SEED})')
+    parser.add_argument('--diverse_calibration', action='store_true',
+                        help='Pick calibration images spread out by colour statistics')
+    parser.add_argument('--workers', type=int,
+                        help='Parallel decode workers (default: OMP_NUM_THREADS or all cores)')
+    args = parser.parse_args(argv)
+
+    PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+    source_dir = args.input_dir if args.input_dir else os.path.join(PROJECT_ROOT, "raw_dataset")
+    processed_dir = args.processed_dir if args.processed_dir else os.path.join(PROJECT_ROOT, "processed_dataset")
+    data_dir = args.data_dir if args.data_dir else os.path.join(PROJECT_ROOT, "data")
+    augmented_dir = args.augmented_dir if args.augmented_dir else os.path.join(PROJECT_ROOT, "augmented_dataset")
+    target_size = (args.img_size, args.img_size)
+
+    if not verify_dataset_structure(source_dir):
+        print("\nRequired folder structure:")
+        for class_name in EXPECTED_CLASSES:
+            print(f"/raw_dataset/{class_name}/")
+        return 1
+
+    # One directory scan gives both the source list and the split plan
+    class_names, plan = plan_split(source_dir, args.validation_split)
+    entries = list(dict.fromkeys((class_name, filename) for _, class_name, filename in plan))
+    if not entries:
+        print(f"Error: no .jpg, .jpeg or .png images found in the class folders of: {source_dir}")
+        return 1
+
+    sinks = []
+    if not args.no_npy:
+        sinks.append(ArraySink(processed_dir, class_names))
+    if not args.no_split:
+        sinks.append(SplitJpegSink(data_dir, class_names, plan))
+    if args.augment:
+        sinks.append(AugmentationSink(augmented_dir, class_names, args.samples))
+    if not args.no_calibration:
+        if args.no_split:
+            print("Calibration needs the train/validation split; skipping it (drop --no_split)")
+        else:
+            sinks.append(CalibrationSink(data_dir, target_size, args.calibration_per_class, args.seed,
+                                         args.diverse_calibration))
+    if not sinks:
+        print("Nothing to do: every output is disabled")
+        return 1
+
+    print(f"\nDecoding {len(entries)} images once for: {', '.join(type(sink).__name__ for sink in sinks)}")
+    skipped = run_engine(source_dir, entries, sinks, target_size, args.workers)
+    print(f"Processed {len(entries) - len(skipped)} images")
+    if skipped:
+        print(f"\nSkipped {len(skipped)} images:")
+        for path, reason in skipped:
+            print(f"- {path}: {reason}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
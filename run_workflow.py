@@ -1,92 +1,617 @@
 import argparse
+import ast
+import cProfile
+import datetime
+import hashlib
+import importlib
+import json
 import os
+import pstats
+import shlex
 import subprocess
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 
-def run_command(command):
-    """Run a command and return its exit code"""
-    print(f"\nExecuting: {command}")
-    result = subprocess.run(command, shell=True)
-    return result.returncode
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Fingerprints of each step's inputs and outputs after its last successful run
+STATE_FILE = os.path.join(PROJECT_ROOT, ".workflow_state.json")
+
+# Per-run resource reports and their history
+DEFAULT_REPORT_DIR = os.path.join(PROJECT_ROOT, "workflow_reports")
+
+# Steps in dependency order
+STEP_ORDER = ["preprocess", "augment", "prepare", "train"]
+
+# Steps that each read raw_dataset/; by default the selected ones are fused
+# into a single preprocess_engine.py pass that decodes every image once
+RAW_STAGES = ["preprocess", "augment", "prepare"]
+
+# Environment variables that cap the thread pools of OpenMP/BLAS, OpenCV
+# and TensorFlow in a step
+THREAD_ENV_VARS = ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS",
+                   "OPENCV_FOR_THREADS_NUM", "TF_NUM_INTRAOP_THREADS"]
+
+class Step:
+    """A workflow step with declared inputs, parameters and outputs"""
+
+    def __init__(self, name, script, args, inputs, outputs, params=None, deps=(), stages=None):
+        self.name = name
+        # The STEP_ORDER names this step covers (several when fused)
+        self.stages = stages or (name,)
+        self.script = script
+        self.module = os.path.splitext(script)[0]
+        self.args = args
+        self.inputs = inputs
+        self.outputs = outputs
+        self.params = params or {}
+        self.deps = deps
+
+    def command(self, python):
+        return [python, self.script] + self.args
+
+def engine_step(stages, raw_dir, processed_dir, augmented_dir, data_dir, args):
+    """One preprocess_engine.py pass producing the outputs of every stage in `stages`"""
+    engine_args = ["--input_dir", raw_dir, "--img_size", str(args.img_size)]
+    outputs = []
+    params = {"img_size": args.img_size}
+    if "preprocess" in stages:
+        engine_args += ["--processed_dir", processed_dir]
+        outputs.append(processed_dir)
+    else:
+        engine_args.append("--no_npy")
+    if "augment" in stages:
+        engine_args += ["--augment", "--samples", str(args.samples), "--augmented_dir", augmented_dir]
+        outputs.append(augmented_dir)
+        params["samples"] = args.samples
+    if "prepare" in stages:
+        # The int8 calibration cache lands in data_dir/.calibration
+        engine_args += ["--data_dir", data_dir]
+        outputs.append(data_dir)
+    else:
+        engine_args += ["--no_split", "--no_calibration"]
+    return Step("+".join(stages), "preprocess_engine.py", engine_args,
+                inputs=[raw_dir], outputs=outputs, params=params, stages=tuple(stages))
+
+def build_steps(args, selected):
+    """Declare the selected steps with their inputs, outputs and parameters
+
+    Unless args.separate_steps is set, the selected raw-dataset stages run as
+    one fused engine step.
+    """
+    raw_dir = os.path.abspath(args.raw_dir or os.path.join(PROJECT_ROOT, "raw_dataset"))
+    processed_dir = os.path.abspath(args.processed_dir or os.path.join(PROJECT_ROOT, "processed_dataset"))
+    augmented_dir = os.path.abspath(args.augmented_dir or os.path.join(PROJECT_ROOT, "augmented_dataset"))
+    data_dir = os.path.abspath(args.data_dir or os.path.join(PROJECT_ROOT, "data"))
+    img_size = str(args.img_size)
+
+    fused = [] if args.separate_steps else [name for name in RAW_STAGES if name in selected]
+    # Name of the step that produces processed_dataset/ for train to depend on
+    preprocess_step = "+".join(fused) if "preprocess" in fused else "preprocess"
+
+    steps = [
+        Step("preprocess", "preprocess.py",
+             ["--input_dir", raw_dir, "--output_dir", processed_dir, "--img_size", img_size],
+             inputs=[raw_dir], outputs=[processed_dir],
+             params={"img_size": args.img_size}),
+        Step("augment", "augment_dataset.py",
+             ["--augment", "--samples", str(args.samples),
+              "--input_dir", raw_dir, "--output_dir", augmented_dir, "--img_size", img_size],
+             inputs=[raw_dir], outputs=[augmented_dir],
+             params={"samples": args.samples, "img_size": args.img_size}),
+        Step("prepare", "prepare_dataset.py",
+             ["--input_dir", raw_dir, "--output_dir", data_dir, "--img_size", img_size],
+             inputs=[raw_dir], outputs=[data_dir],
+             params={"img_size": args.img_size}),
+        # train_model.py trains on the preprocessed .npy arrays (and takes their size)
+        Step("train", "train_model.py",
+             ["--processed_dir", processed_dir, "--alpha", str(args.alpha)],
+             inputs=[processed_dir],
+             outputs=[os.path.join(PROJECT_ROOT, "cloud", "model"),
+                      os.path.join(PROJECT_ROOT, "esp32", "model")],
+             params={"alpha": args.alpha},
+             deps=(preprocess_step,)),
+    ]
+    steps = [step for step in steps if step.name in selected and step.name not in fused]
+    if fused:
+        steps.append(engine_step(fused, raw_dir, processed_dir, augmented_dir, data_dir, args))
+    # Keep dependency order: the fused step takes the place of its first stage
+    steps.sort(key=lambda step: STEP_ORDER.index(step.stages[0]))
+    return {step.name: step for step in steps}
+
+def load_state():
+    if not os.path.exists(STATE_FILE):
+        return {"steps": {}, "file_hashes": {}}
+    with open(STATE_FILE, 'r') as f:
+        return json.load(f)
+
+def save_state(state):
+    # Forget hashes of files that no longer exist
+    state["file_hashes"] = {path: entry for path, entry in state["file_hashes"].items()
+                            if os.path.exists(path)}
+    tmp_path = STATE_FILE + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, STATE_FILE)
+
+def hash_file(path, hash_cache):
+    """SHA-256 of a file's content, reused while its size and mtime are unchanged"""
+    stat = os.stat(path)
+    cached = hash_cache.get(path)
+    if cached and cached["size"] == stat.st_size and cached["mtime_ns"] == stat.st_mtime_ns:
+        return cached["sha256"]
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    hash_cache[path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+                        "sha256": digest.hexdigest()}
+    return digest.hexdigest()
+
+def fingerprint_paths(paths, hash_cache):
+    """Content fingerprint of files and directory trees"""
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(path.encode())
+        if os.path.isfile(path):
+            digest.update(hash_file(path, hash_cache).encode())
+        elif os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    file_path = os.path.join(root, name)
+                    digest.update(os.path.relpath(file_path, path).encode())
+                    digest.update(hash_file(file_path, hash_cache).encode())
+        else:
+            digest.update(b"<missing>")
+    return digest.hexdigest()
+
+def local_dependencies(script):
+    """The script and every project module it imports, directly or transitively
+
+    Imports inside functions count too, since most heavy modules are loaded lazily.
+    """
+    found = set()
+    queue = [os.path.join(PROJECT_ROOT, script)]
+    while queue:
+        path = queue.pop()
+        if path in found:
+            continue
+        found.add(path)
+        with open(path, 'r', encoding='utf-8') as f:
+            tree = ast.parse(f.read(), filename=path)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+                names = [node.module]
+            else:
+                continue
+            for name in names:
+                module_path = os.path.join(PROJECT_ROOT, name.split('.')[0] + '.py')
+                if os.path.isfile(module_path):
+                    queue.append(module_path)
+    return sorted(found)
+
+def input_fingerprint(step, hash_cache):
+    """Fingerprint of the step's code (with its local imports), parameters and input data"""
+    digest = hashlib.sha256()
+    for path in local_dependencies(step.script):
+        digest.update(os.path.relpath(path, PROJECT_ROOT).encode())
+        digest.update(hash_file(path, hash_cache).encode())
+    digest.update(json.dumps(step.params, sort_keys=True).encode())
+    digest.update(json.dumps(step.args).encode())
+    digest.update(fingerprint_paths(step.inputs, hash_cache).encode())
+    return digest.hexdigest()
+
+def plan_steps(steps, forced, state):
+    """Decide which steps must run and why"""
+    hash_cache = state["file_hashes"]
+    plan = []
+    will_run = set()
+    for name, step in steps.items():
+        previous = state["steps"].get(name)
+        upstream = [dep for dep in step.deps if dep in will_run]
+
+        if "all" in forced or forced.intersection(step.stages):
+            reason = "forced"
+        elif upstream:
+            # Inputs are produced by a step that is about to run
+            reason = f"upstream step '{upstream[0]}' will run"
+        elif previous is None:
+            reason = "never run"
+        elif previous["inputs"] != input_fingerprint(step, hash_cache):
+            reason = "inputs changed"
+        elif previous["outputs"] != fingerprint_paths(step.outputs, hash_cache):
+            reason = "outputs changed or missing"
+        else:
+            reason = None
+
+        if reason:
+            will_run.add(name)
+        plan.append((step, reason))
+    return plan
+
+def thread_env(threads):
+    """Environment overrides that limit a step to `threads` cores"""
+    env = {name: str(threads) for name in THREAD_ENV_VARS}
+    env["TF_NUM_INTEROP_THREADS"] = "1" if threads < 4 else "2"
+    return env
+
+def read_proc_io(pid="self"):
+    """Logical bytes read/written by a process so far (Linux /proc), or None"""
+    try:
+        with open(f"/proc/{pid}/io") as f:
+            fields = dict(line.split(":", 1) for line in f)
+        return {"read": int(fields["rchar"]), "written": int(fields["wchar"])}
+    except (OSError, KeyError, ValueError):
+        return None
+
+def count_files_since(paths, since):
+    """Number of files under `paths` created or modified after `since`"""
+    count = 0
+    for path in paths:
+        for root, _, files in os.walk(path):
+            for name in files:
+                try:
+                    if os.path.getmtime(os.path.join(root, name)) >= since:
+                        count += 1
+                except OSError:
+                    pass
+    return count
+
+def hot_functions(profile_path, limit=15):
+    """Top functions by own time from a cProfile dump"""
+    stats = pstats.Stats(profile_path)
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:limit]
+    return [{
+        "function": f"{os.path.relpath(filename, PROJECT_ROOT) if filename.startswith(PROJECT_ROOT) else filename}:{line}({name})",
+        "calls": calls,
+        "own_seconds": round(own_time, 4),
+        "cumulative_seconds": round(cumulative_time, 4),
+    } for (filename, line, name), (_, calls, own_time, cumulative_time, _) in rows]
+
+def run_command(command, env=None, profile_path=None):
+    """Run a command and return its exit code and resource usage"""
+    if profile_path:
+        command = [command[0], "-m", "cProfile", "-o", profile_path] + command[1:]
+    print(f"\nExecuting: {shlex.join(command)}")
+    process = subprocess.Popen(command, cwd=PROJECT_ROOT, env=env)
+
+    # Without wait4 (e.g. on Windows) only the exit code is available
+    if not hasattr(os, "wait4"):
+        return process.wait(), {}
+
+    # Wait for the exit without reaping the child, so its final I/O counters
+    # can still be read from /proc, then collect its own rusage with wait4
+    io = None
+    if hasattr(os, "waitid"):
+        os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOWAIT)
+        io = read_proc_io(process.pid)
+    _, status, rusage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+
+    usage = {
+        "user_cpu_seconds": round(rusage.ru_utime, 2),
+        "sys_cpu_seconds": round(rusage.ru_stime, 2),
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": round(rusage.ru_maxrss / 1024, 1),
+        # Logical bytes through read()/write(), including page-cache hits
+        "bytes_read": io["read"] if io else None,
+        "bytes_written": io["written"] if io else None,
+        # Bytes that actually went to or from the block device (512-byte blocks)
+        "block_read_bytes": rusage.ru_inblock * 512,
+        "block_written_bytes": rusage.ru_oublock * 512,
+    }
+    return process.returncode, usage
+
+def run_in_process(step, profile_path=None):
+    """Run a step through its module's main(argv) and return its exit code and usage
+
+    CPU time, peak RSS and I/O are process-wide, so they include any steps
+    running concurrently in other threads.
+    """
+    print(f"\nExecuting in-process: {step.module}.main({step.args})")
+    before = resource.getrusage(resource.RUSAGE_SELF) if resource else None
+    io_before = read_proc_io()
+    profiler = cProfile.Profile() if profile_path else None
+    try:
+        # The module (and its heavy imports) is only loaded when the step runs
+        module = importlib.import_module(step.module)
+        if profiler:
+            profiler.enable()
+        code = module.main(step.args) or 0
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else 1
+    except Exception as e:
+        print(f"\nError in step '{step.name}': {str(e)}")
+        code = 1
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(profile_path)
+
+    usage = {}
+    if before:
+        after = resource.getrusage(resource.RUSAGE_SELF)
+        usage.update({
+            "user_cpu_seconds": round(after.ru_utime - before.ru_utime, 2),
+            "sys_cpu_seconds": round(after.ru_stime - before.ru_stime, 2),
+            "peak_rss_mb": round(after.ru_maxrss / 1024, 1),
+            "block_read_bytes": (after.ru_inblock - before.ru_inblock) * 512,
+            "block_written_bytes": (after.ru_oublock - before.ru_oublock) * 512,
+        })
+    io_after = read_proc_io()
+    if io_before and io_after:
+        usage["bytes_read"] = io_after["read"] - io_before["read"]
+        usage["bytes_written"] = io_after["written"] - io_before["written"]
+    return code, usage
+
+def execute_plan(plan, state, python, jobs, cores, in_process, profile_dir=None):
+    """Run the planned steps, overlapping independent ones
+
+    Up to `jobs` steps run at once and share `cores` between them. A step
+    starts once the steps it depends on have finished. Returns the first
+    non-zero exit code (or 0) and a per-step resource report.
+    """
+    hash_cache = state["file_hashes"]
+    pending = [step for step, reason in plan if reason]
+    pending_names = {step.name for step in pending}
+    running = {}
+    exit_code = 0
+    workflow_start = time.perf_counter()
+    results = {step.name: {"status": "skipped", "reason": reason or "up to date"}
+               for step, reason in plan}
+
+    # In-process steps share this process, so its thread caps are set once
+    # (OpenCV and TensorFlow read them when they are first imported)
+    if in_process:
+        os.environ.update(thread_env(max(1, cores // max(1, min(jobs, len(pending))))))
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        while pending or running:
+            # Start every step whose dependencies are done, within the job limit
+            ready = [step for step in pending
+                     if not any(dep in pending_names for dep in step.deps)]
+            if exit_code != 0:
+                ready = []
+            slots = jobs - len(running)
+            threads = max(1, cores // max(1, min(jobs, len(running) + len(ready))))
+            for step in ready[:slots]:
+                # Fingerprint the inputs as this step consumes them (upstream
+                # steps may have just rewritten them)
+                inputs = input_fingerprint(step, hash_cache)
+                profile_path = None
+                if profile_dir:
+                    profile_path = os.path.join(profile_dir, f"{step.name}.prof")
+                if in_process:
+                    future = executor.submit(run_in_process, step, profile_path)
+                else:
+                    env = dict(os.environ, **thread_env(threads))
+                    future = executor.submit(run_command, step.command(python), env, profile_path)
+                print(f"\n[{step.name}] started with {threads} core(s)")
+                running[future] = (step, inputs, time.time(), time.perf_counter(), profile_path)
+                results[step.name]["cores"] = threads
+                pending.remove(step)
+
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                step, inputs, started_at, started, profile_path = running.pop(future)
+                pending_names.discard(step.name)
+                code, usage = future.result()
+                elapsed = time.perf_counter() - started
+
+                result = results[step.name]
+                result.update({"status": "ok" if code == 0 else "failed",
+                               "wall_seconds": round(elapsed, 2)})
+                result.update(usage)
+                result["files_produced"] = count_files_since(step.outputs, started_at)
+                if profile_path and os.path.exists(profile_path):
+                    result["profile"] = os.path.relpath(profile_path, PROJECT_ROOT)
+                    result["hot_functions"] = hot_functions(profile_path)
+
+                if code != 0:
+                    print(f"\nError: Step '{step.name}' failed with exit code {code}")
+                    print(f"Failed command: {shlex.join(step.command(python))}")
+                    exit_code = exit_code or code
+                    continue
+
+                print(f"\n[{step.name}] finished in {elapsed:.1f}s")
+                state["steps"][step.name] = {
+                    "inputs": inputs,
+                    "outputs": fingerprint_paths(step.outputs, hash_cache),
+                }
+                save_state(state)
+
+    if pending and exit_code != 0:
+        print(f"Skipped after failure: {', '.join(step.name for step in pending)}")
+        for step in pending:
+            results[step.name]["reason"] = "earlier step failed"
+    save_state(state)
+    wall_seconds = time.perf_counter() - workflow_start
+    print(f"\nWorkflow wall time: {wall_seconds:.1f}s")
+    return exit_code, {"wall_seconds": round(wall_seconds, 2), "steps": results}
+
+def load_history(report_dir):
+    history_path = os.path.join(report_dir, "history.jsonl")
+    if not os.path.exists(history_path):
+        return []
+    with open(history_path, 'r') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def find_regressions(report, history, threshold):
+    """Compare each step with its last successful run in the history"""
+    regressions = []
+    for name, result in report["steps"].items():
+        if result["status"] != "ok":
+            continue
+        previous = next((run["steps"][name] for run in reversed(history)
+                         if run["steps"].get(name, {}).get("status") == "ok"), None)
+        if not previous:
+            continue
+        for metric in ("wall_seconds", "user_cpu_seconds", "peak_rss_mb"):
+            now, before = result.get(metric), previous.get(metric)
+            if now is None or not before:
+                continue
+            change = (now - before) / before * 100
+            # Ignore noise on steps that only take a moment or a few MB
+            if change > threshold and now - before > 1.0:
+                regressions.append(f"{name}: {metric} {before} -> {now} ({change:+.0f}%)")
+    return regressions
+
+def print_report(report):
+    print("\nResource profile:")
+    print(f"{'step':<27}{'status':>9}{'wall':>9}{'user':>9}{'sys':>8}{'peak RSS':>11}"
+          f"{'read':>10}{'written':>10}{'disk read':>11}{'disk write':>11}{'files':>7}")
+
+    def fmt(value, scale=1, suffix=""):
+        return "-" if value is None else f"{value / scale:.1f}{suffix}"
+
+    for name, r in report["steps"].items():
+        print(f"{name:<27}{r['status']:>9}{fmt(r.get('wall_seconds'), suffix='s'):>9}"
+              f"{fmt(r.get('user_cpu_seconds'), suffix='s'):>9}{fmt(r.get('sys_cpu_seconds'), suffix='s'):>8}"
+              f"{fmt(r.get('peak_rss_mb'), suffix=' MB'):>11}"
+              f"{fmt(r.get('bytes_read'), 1 << 20, ' MB'):>10}{fmt(r.get('bytes_written'), 1 << 20, ' MB'):>10}"
+              f"{fmt(r.get('block_read_bytes'), 1 << 20, ' MB'):>11}{fmt(r.get('block_written_bytes'), 1 << 20, ' MB'):>11}"
+              f"{r.get('files_produced', '-'):>7}")
+        for entry in r.get("hot_functions", [])[:5]:
+            print(f"    {entry['own_seconds']:>8.2f}s  {entry['function']}")
+
+def save_report(report, report_dir, threshold):
+    """Write the run's report, append it to the history and flag regressions"""
+    history = load_history(report_dir)
+    report["regressions"] = find_regressions(report, history, threshold)
+
+    stamp = report["timestamp"].replace("-", "").replace(":", "").replace(" ", "_")
+    report_path = os.path.join(report_dir, f"report_{stamp}.json")
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    with open(os.path.join(report_dir, "history.jsonl"), 'a') as f:
+        f.write(json.dumps(report) + "\n")
+
+    print_report(report)
+    if report["regressions"]:
+        print(f"\nRegressions above {threshold:.0f}% compared with the previous run:")
+        for regression in report["regressions"]:
+            print(f"- {regression}")
+    print(f"\nReport saved to: {report_path}")
+
+def print_plan(plan):
+    print("\nWorkflow plan:")
+    for step, reason in plan:
+        status = f"run ({reason})" if reason else "skip (up to date)"
+        print(f"- {step.name:<27} {status}")
 
 def main():
     """Run the tomato disease detection workflow with configurable options"""
     parser = argparse.ArgumentParser(description="Tomato Disease Detection Workflow")
-    
+
     # Add workflow steps as options
     parser.add_argument("--preprocess", action="store_true", help="Run the preprocessing step")
     parser.add_argument("--augment", action="store_true", help="Run the augmentation step")
     parser.add_argument("--prepare", action="store_true", help="Run the dataset preparation step")
     parser.add_argument("--train", action="store_true", help="Run the model training step")
     parser.add_argument("--all", action="store_true", help="Run all steps in sequence")
-    
+
     # Add augmentation options
-    parser.add_argument("--samples", type=int, default=3, 
+    parser.add_argument("--samples", type=int, default=3,
                         help="Number of augmented samples per image (default: 3)")
-    
+
+    # Add model input options
+    parser.add_argument("--img_size", type=int, default=96,
+                        help="Square model input size in pixels (default: 96)")
+    parser.add_argument("--alpha", type=float, default=1.0,
+                        help="MobileNetV2 width multiplier for train_model.py (default: 1.0)")
+
     # Add custom directory options
-    parser.add_argument("--raw_dir", type=str, 
+    parser.add_argument("--raw_dir", type=str,
                         help="Custom raw dataset directory (default: raw_dataset)")
-    parser.add_argument("--processed_dir", type=str, 
+    parser.add_argument("--processed_dir", type=str,
                         help="Custom processed dataset directory (default: processed_dataset)")
-    parser.add_argument("--augmented_dir", type=str, 
+    parser.add_argument("--augmented_dir", type=str,
                         help="Custom augmented dataset directory (default: augmented_dataset)")
-    parser.add_argument("--data_dir", type=str, 
+    parser.add_argument("--data_dir", type=str,
                         help="Custom data directory for training (default: data)")
-    
+
+    # Add caching options
+    parser.add_argument("--force", action="append", default=[], metavar="STEP",
+                        choices=STEP_ORDER + ["all"],
+                        help="Re-run STEP even if its inputs are unchanged (repeatable, or 'all')")
+    parser.add_argument("--dry-run", dest="dry_run", action="store_true",
+                        help="Show which steps would run and why, without running them")
+
+    # Add execution options
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="Maximum number of independent steps to run at once (default: 1)")
+    parser.add_argument("--cores", type=int, default=os.cpu_count() or 1,
+                        help="Total CPU cores shared by concurrently running steps (default: all)")
+    parser.add_argument("--in-process", dest="in_process", action="store_true",
+                        help="Run steps through their importable main() instead of new Python processes")
+    parser.add_argument("--separate_steps", action="store_true",
+                        help="Run preprocess, augment and prepare as separate scripts, each decoding "
+                             "raw_dataset itself, instead of one preprocess_engine.py pass")
+
+    # Add profiling options
+    parser.add_argument("--profile", action="store_true",
+                        help="Also record a cProfile of each step and report its hottest functions")
+    parser.add_argument("--report_dir", type=str, default=DEFAULT_REPORT_DIR,
+                        help="Directory for resource reports and their history (default: workflow_reports)")
+    parser.add_argument("--regression_threshold", type=float, default=20.0,
+                        help="Flag steps whose time or memory grew by more than this percent (default: 20)")
+
     # Parse arguments
     args = parser.parse_args()
-    
+
     # Check if at least one action is specified
     if not (args.preprocess or args.augment or args.prepare or args.train or args.all):
         parser.print_help()
         return 1
-    
-    # Prepare commands
-    commands = []
-    
+
+    selected = {name for name in STEP_ORDER if args.all or getattr(args, name)}
+    steps = build_steps(args, selected)
+    state = load_state()
+    plan = plan_steps(steps, set(args.force), state)
+    print_plan(plan)
+
+    if args.dry_run:
+        save_state(state)  # keep the file hashes computed while planning
+        return 0
+
     # Python executable - use the one that's running this script
     python = sys.executable
-    
-    # Add steps based on options
-    if args.preprocess or args.all:
-        cmd = f"{python} preprocess.py"
-        if args.raw_dir:
-            # Note: preprocess.py doesn't currently support custom dirs via args,
-            # so we're noting this limitation
-            print("Note: Custom raw_dir not supported in preprocess.py")
-        commands.append(cmd)
-    
-    if args.augment or args.all:
-        cmd = f"{python} augment_dataset.py --augment --samples {args.samples}"
-        if args.raw_dir:
-            cmd += f" --input_dir {args.raw_dir}"
-        if args.augmented_dir:
-            cmd += f" --output_dir {args.augmented_dir}"
-        commands.append(cmd)
-    
-    if args.prepare or args.all:
-        cmd = f"{python} prepare_dataset.py"
-        # Note: prepare_dataset.py doesn't currently support custom dirs via args
-        if args.raw_dir or args.data_dir:
-            print("Note: Custom directories not supported in prepare_dataset.py")
-        commands.append(cmd)
-    
-    if args.train or args.all:
-        cmd = f"{python} train_model.py"
-        # Note: train_model.py doesn't currently support custom dirs via args
-        if args.processed_dir or args.data_dir:
-            print("Note: Custom directories not supported in train_model.py")
-        commands.append(cmd)
-    
-    # Execute commands
-    for cmd in commands:
-        exit_code = run_command(cmd)
-        if exit_code != 0:
-            print(f"\nError: Command failed with exit code {exit_code}")
-            print(f"Failed command: {cmd}")
-            return exit_code
-    
+
+    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    os.makedirs(args.report_dir, exist_ok=True)
+    profile_dir = None
+    if args.profile:
+        stamp = timestamp.replace("-", "").replace(":", "").replace(" ", "_")
+        profile_dir = os.path.join(args.report_dir, "profiles", stamp)
+        os.makedirs(profile_dir, exist_ok=True)
+
+    # Execute steps, skipping those whose inputs are unchanged
+    exit_code, report = execute_plan(plan, state, python, max(1, args.jobs), max(1, args.cores),
+                                     args.in_process, profile_dir)
+    report.update({
+        "timestamp": timestamp,
+        "mode": "in-process" if args.in_process else "subprocess",
+        "jobs": args.jobs,
+        "cores": args.cores,
+        "exit_code": exit_code,
+    })
+    save_report(report, args.report_dir, args.regression_threshold)
+    if exit_code != 0:
+        return exit_code
+
     print("\nWorkflow completed successfully!")
     return 0
 
@@ -0,0 +1,154 @@
+import argparse
+import csv
+import datetime
+import json
+import os
+import sys
+
+import cv2
+import numpy as np
+
+# Input-resolution / width-multiplier sweep for the ESP32 model. Raw images are
+# decoded once and preprocessed once per input size (preprocess.preprocess_rgb);
+# every alpha at that size reuses the same in-memory arrays. Each configuration
+# is trained with tomato_cnn's two-phase schedule, exported to int8 TFLite and
+# measured on the host, and the latency/accuracy Pareto front is reported.
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+def load_raw_dataset(raw_dir, img_sizes):
+    """Decode every image once and preprocess it at each size (uint8 arrays)"""
+    from preprocess import preprocess_rgb
+
+    class_names = sorted(d for d in os.listdir(raw_dir) if os.path.isdir(os.path.join(raw_dir, d)))
+    images = {size: [] for size in img_sizes}
+    labels = []
+    for class_idx, class_name in enumerate(class_names):
+        class_dir = os.path.join(raw_dir, class_name)
+        files = sorted(f for f in os.listdir(class_dir) if f.lower().endswith(('.png', '.jpg', '.jpeg')))
+        print(f"Decoding {len(files)} images from {class_name}/")
+        for f in files:
+            img = cv2.imread(os.path.join(class_dir, f))
+            if img is None:
+                print(f"Warning: Could not read {os.path.join(class_dir, f)}")
+                continue
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+            for size in img_sizes:
+                # preprocess_rgb returns uint8 values / 255, so this round-trips exactly
+                images[size].append(np.round(preprocess_rgb(img, (size, size)) * 255).astype(np.uint8))
+            labels.append(class_idx)
+    return {size: np.stack(arrays) for size, arrays in images.items()}, np.array(labels), class_names
+
+def make_datasets(x_train, y_train, x_valid, y_valid, batch_size):
+    """tf.data pipelines matching tomato_cnn.prepare_dataset (rescale + flip/rotate)"""
+    import tensorflow as tf
+
+    augmentation = tf.keras.Sequential([
+        tf.keras.layers.RandomFlip("horizontal"),
+        tf.keras.layers.RandomRotation(0.2),
+    ])
+
+    def scale(x, y):
+        return tf.cast(x, tf.float32) / 255.0, y
+
+    train = (tf.data.Dataset.from_tensor_slices((x_train, y_train))
+             .shuffle(len(x_train), seed=42)
+             .batch(batch_size)
+             .map(scale, num_parallel_calls=tf.data.AUTOTUNE)
+             .map(lambda x, y: (augmentation(x, training=True), y), num_parallel_calls=tf.data.AUTOTUNE)
+             .prefetch(tf.data.AUTOTUNE))
+    valid = (tf.data.Dataset.from_tensor_slices((x_valid, y_valid))
+             .batch(batch_size)
+             .map(scale, num_parallel_calls=tf.data.AUTOTUNE)
+             .cache()
+             .prefetch(tf.data.AUTOTUNE))
+    return train, valid
+
+def pareto_front(results):
+    """Mark configurations that no other one beats on both latency and accuracy"""
+    for r in results:
+        r['pareto'] = not any(
+            o['latency_ms'] <= r['latency_ms'] and o['accuracy'] >= r['accuracy']
+            and (o['latency_ms'] < r['latency_ms'] or o['accuracy'] > r['accuracy'])
+            for o in results)
+    return results
+
+def print_report(results):
+    print("\nSweep results (* = on the latency/accuracy Pareto front):")
+    print(f"  {'size':>5}{'alpha':>7}{'accuracy':>10}{'latency':>11}{'size KB':>10}{'params':>10}")
+    for r in sorted(results, key=lambda r: r['latency_ms']):
+        mark = '*' if r['pareto'] else ' '
+        print(f"{mark} {r['img_size']:>5}{r['alpha']:>7}{r['accuracy']:>10.3f}"
+              f"{r['latency_ms']:>9.2f}ms{r['size_kb']:>10.1f}{r['params']:>10}")
+
+def main(argv=None):
+    """Train, export and measure every (input size, alpha) configuration"""
+    parser = argparse.ArgumentParser(description='Sweep input size and MobileNetV2 alpha for the ESP32 model')
+    parser.add_argument('--raw_dir', type=str, help='Raw dataset directory (default: raw_dataset)')
+    parser.add_argument('--img_sizes', type=int, nargs='+', default=[64, 80, 96],
+                        help='Square input sizes to try (default: 64 80 96)')
+    parser.add_argument('--alphas', type=float, nargs='+', default=[0.35, 0.5, 0.75],
+                        help='MobileNetV2 width multipliers to try (default: 0.35 0.5 0.75)')
+    parser.add_argument('--epochs', type=int, default=5, help='Head training epochs (default: 5)')
+    parser.add_argument('--fine_tune_epochs', type=int, default=5, help='Fine-tuning epochs (default: 5)')
+    parser.add_argument('--batch_size', type=int, default=32, help='Training batch size (default: 32)')
+    parser.add_argument('--validation_split', type=float, default=0.2,
+                        help='Fraction of images held out for evaluation (default: 0.2)')
+    parser.add_argument('--calibration_images', type=int, default=100,
+                        help='Training images used for int8 calibration (default: 100)')
+    parser.add_argument('--output_dir', type=str, help='Where models and reports go (default: sweep_results)')
+    args = parser.parse_args(argv)
+
+    import tensorflow as tf
+    from sklearn.model_selection import train_test_split
+    import tomato_cnn
+
+    raw_dir = args.raw_dir if args.raw_dir else os.path.join(PROJECT_ROOT, "raw_dataset")
+    output_dir = args.output_dir if args.output_dir else os.path.join(PROJECT_ROOT, "sweep_results")
+    os.makedirs(output_dir, exist_ok=True)
+
+    images, labels, class_names = load_raw_dataset(raw_dir, args.img_sizes)
+    train_idx, valid_idx = train_test_split(
+        np.arange(len(labels)), test_size=args.validation_split,
+        random_state=42, stratify=labels)
+    print(f"\n{len(train_idx)} training and {len(valid_idx)} validation images, "
+          f"{len(args.img_sizes) * len(args.alphas)} configurations")
+
+    results = []
+    for size in args.img_sizes:
+        x = images[size]
+        train, valid = make_datasets(x[train_idx], labels[train_idx], x[valid_idx], labels[valid_idx],
+                                     args.batch_size)
+        calibration = x[train_idx[:args.calibration_images]].astype(np.float32) / 255.0
+
+        for alpha in args.alphas:
+            print(f"\n=== {size}x{size}, alpha={alpha} ===")
+            tf.keras.backend.clear_session()
+            model = tomato_cnn.create_model(len(class_names), input_shape=(size, size, 3), alpha=alpha)
+            tomato_cnn.train_two_phase(model, train, valid, args.epochs, args.fine_tune_epochs)
+
+            tflite_path = os.path.join(output_dir, f"tomato_model_{size}_a{alpha}.tflite")
+            tomato_cnn.convert_to_tflite(model, tflite_path, None, representative_images=calibration)
+            metrics = tomato_cnn.evaluate_tflite(tflite_path, valid)
+            results.append(dict(img_size=size, alpha=alpha, params=int(model.count_params()),
+                                tflite_path=tflite_path, **metrics))
+            print(f"accuracy {metrics['accuracy']:.3f}, latency {metrics['latency_ms']:.2f}ms, "
+                  f"size {metrics['size_kb']:.1f}KB")
+
+    pareto_front(results)
+    print_report(results)
+
+    stamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    json_path = os.path.join(output_dir, f"sweep_{stamp}.json")
+    with open(json_path, 'w') as f:
+        json.dump({'classes': class_names, 'settings': vars(args), 'results': results}, f, indent=2)
+    csv_path = os.path.join(output_dir, f"sweep_{stamp}.csv")
+    with open(csv_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(results[0]))
+        writer.writeheader()
+        writer.writerows(results)
+    print(f"\nReport saved to: {json_path} and {csv_path}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
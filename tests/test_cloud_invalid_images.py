@@ -0,0 +1,78 @@
+import base64
+import os
+from io import BytesIO
+
+import pytest
+
+np = pytest.importorskip("numpy")
+flask = pytest.importorskip("flask")
+Image = pytest.importorskip("PIL.Image")
+pytest.importorskip("functions_framework")
+
+# Keep the import from loading a model in the background
+os.environ['EAGER_LOAD'] = '0'
+import main  # noqa: E402
+
+class StubModel:
+    version = 'test'
+    class_names = ['healthy', 'sick']
+    input_size = (96, 96)
+
+    def __init__(self, use_graph_preprocess=False, run_bytes=None, run_image=None):
+        self.use_graph_preprocess = use_graph_preprocess
+        self._run_bytes = run_bytes
+        self._run_image = run_image
+
+    def run_bytes(self, encoded_images):
+        return self._run_bytes(encoded_images)
+
+    def run_image(self, img):
+        if self._run_image:
+            return self._run_image(img)
+        np.asarray(img)
+        return np.array([[0.25, 0.75]], dtype=np.float32)
+
+def truncated_jpeg():
+    buffer = BytesIO()
+    rng = np.random.default_rng(0)
+    Image.fromarray(rng.integers(0, 256, size=(200, 200, 3), dtype=np.uint8)).save(buffer, format='JPEG')
+    return buffer.getvalue()[:len(buffer.getvalue()) // 2]
+
+@pytest.fixture
+def serve(monkeypatch):
+    def post(model, raw):
+        monkeypatch.setattr(main, 'current_model', model)
+        monkeypatch.setattr(main, 'model_ready', True)
+        app = flask.Flask(__name__)
+        with app.test_request_context(json={'image': base64.b64encode(raw).decode('utf-8')}):
+            response, status, _ = main.predict(flask.request)
+            return status, response.get_json()
+    return post
+
+def test_truncated_jpeg_is_a_bad_request(serve):
+    status, body = serve(StubModel(), truncated_jpeg())
+    assert status == 400
+    assert body['error'].startswith('Invalid image data')
+
+def test_pool_timeout_is_still_busy(serve):
+    def busy(img):
+        raise TimeoutError("no free session")
+    # TimeoutError is an OSError, but must not be reported as a bad image
+    buffer = BytesIO()
+    Image.new('RGB', (96, 96)).save(buffer, format='JPEG')
+    status, _ = serve(StubModel(run_image=busy), buffer.getvalue())
+    assert status == 503
+
+def test_graph_decode_error_is_a_bad_request(serve):
+    tf = pytest.importorskip("tensorflow")
+    from backends import SavedModelBackend
+
+    # A backend whose serve_bytes signature only decodes, like the exported one
+    backend = SavedModelBackend.__new__(SavedModelBackend)
+    backend._tf = tf
+    backend.bytes_input_name = 'images'
+    backend.bytes_func = lambda images: tf.cast(tf.io.decode_jpeg(images[0], channels=3), tf.float32)
+
+    status, body = serve(StubModel(use_graph_preprocess=True, run_bytes=backend.predict_bytes), truncated_jpeg())
+    assert status == 400
+    assert body['error'].startswith('Invalid image data')
@@ -0,0 +1,18 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+cv2 = pytest.importorskip("cv2")
+pytest.importorskip("tensorflow")
+
+import graph_preprocess  # noqa: E402
+
+@pytest.mark.parametrize("height,width", [(96, 96), (100, 100), (96, 100), (75, 128)])
+def test_clahe_matches_cv2(height, width):
+    rng = np.random.default_rng(height * width)
+    channel = rng.integers(0, 256, size=(height, width), dtype=np.uint8)
+    expected = cv2.createCLAHE(clipLimit=graph_preprocess.CLIP_LIMIT,
+                               tileGridSize=graph_preprocess.TILE_GRID_SIZE).apply(channel)
+    result = graph_preprocess.clahe(channel[np.newaxis].astype(np.float32)).numpy()[0]
+    assert result.shape == (height, width)
+    # Rounding may differ by one level
+    assert np.abs(result.astype(int) - expected.astype(int)).max() <= 1
@@ -0,0 +1,56 @@
+import json
+import os
+
+import pytest
+
+np = pytest.importorskip("numpy")
+cv2 = pytest.importorskip("cv2")
+pytest.importorskip("sklearn")
+pytest.importorskip("tensorflow")
+
+CLASSES = ['early_blight_leaf', 'healthy_leaf', 'late_blight_leaf', 'septoria_leaf']
+
+@pytest.fixture
+def raw_dataset(tmp_path):
+    rng = np.random.default_rng(0)
+    for class_name in CLASSES:
+        class_dir = tmp_path / "raw" / class_name
+        class_dir.mkdir(parents=True)
+        for i in range(40):
+            img = rng.integers(0, 256, size=(48, 64, 3), dtype=np.uint8)
+            cv2.imwrite(str(class_dir / f"img_{i}.jpg"), img)
+    return tmp_path / "raw"
+
+def test_shards_mix_classes(raw_dataset, tmp_path):
+    import prepare_dataset
+    import tomato_cnn
+
+    output_dir = tmp_path / "data"
+    # Tiny shards, so the split is spread over several files
+    prepare_dataset.organize_dataset(str(raw_dataset), str(output_dir), target_size=(32, 32),
+                                     output_format='tfrecord', shard_size_mb=0.05, workers=2)
+    tfrecord_dir = os.path.join(output_dir, 'tfrecords')
+    with open(os.path.join(tfrecord_dir, 'metadata.json')) as f:
+        metadata = json.load(f)
+    assert metadata['shards']['train'] > 1
+
+    # Without a training shuffle the read order is the order on disk
+    _, labels = next(iter(tomato_cnn.read_tfrecord_split(tfrecord_dir, 'train', batch_size=16,
+                                                         deterministic=True)))
+    counts = np.bincount(labels.numpy(), minlength=len(CLASSES))
+    assert (counts > 0).sum() >= 3
+    assert counts.max() <= 10
+
+def test_shard_order_is_reproducible(raw_dataset, tmp_path):
+    import prepare_dataset
+    import tomato_cnn
+
+    first_labels = []
+    for run in range(2):
+        output_dir = tmp_path / f"data_{run}"
+        prepare_dataset.organize_dataset(str(raw_dataset), str(output_dir), target_size=(32, 32),
+                                         output_format='tfrecord', shard_size_mb=0.05, workers=2)
+        _, labels = next(iter(tomato_cnn.read_tfrecord_split(
+            os.path.join(output_dir, 'tfrecords'), 'train', batch_size=32, deterministic=True)))
+        first_labels.append(labels.numpy().tolist())
+    assert first_labels[0] == first_labels[1]
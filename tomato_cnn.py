@@ -1,13 +1,18 @@
 import tensorflow as tf
+import numpy as np
 import os
+import json
+import gzip
+import time
+import argparse
 
-def create_model(num_classes):
+def create_model(num_classes, input_shape=(96, 96, 3), alpha=0.35):
     # Using pre-trained weights from ImageNet
     base_model = tf.keras.applications.MobileNetV2(
         weights='imagenet',        
         include_top=False,         
-        input_shape=(96, 96, 3),   
-        alpha=0.35                
+        input_shape=input_shape,   
+        alpha=alpha                
     )
     
     # Base model layers are FROZEN initially (this is the freezing part!)
@@ -23,7 +28,8 @@ def create_model(num_classes):
     
     return model
 
-def convert_to_tflite(model, filename, data_dir):
+def convert_to_tflite(model, filename, data_dir, sparse=False, representative_images=None,
+                      diverse_calibration=False):
     # More aggressive optimization for ESP32
     converter = tf.lite.TFLiteConverter.from_keras_model(model)
     converter.optimizations = [tf.lite.Optimize.DEFAULT]
@@ -34,29 +40,27 @@ def convert_to_tflite(model, filename, data_dir):
     # Add post-training quantization
     converter.optimizations = [tf.lite.Optimize.OPTIMIZE_FOR_SIZE]
     
-    # Use more aggressive pruning
+    # Pruned models: store sparse weights in a compact encoding
+    if sparse:
+        converter.optimizations.append(tf.lite.Optimize.EXPERIMENTAL_SPARSITY)
+    
+    # Use the MLIR-based converter
     converter.experimental_new_converter = True
     
-    # Create a wrapper function that captures data_dir
-    def representative_dataset_gen():
-        train_dir = os.path.join(data_dir, 'train')
-        print(f"Reading calibration data from: {train_dir}")
+    if representative_images is None:
+        # Cached, stratified and seeded sample of data_dir/train (20 images per
+        # class), decoded once per dataset version and at the model's input size
+        from calibration_set import build_calibration_set, representative_dataset
+        img_size = (model.input_shape[2], model.input_shape[1])  # (width, height) for OpenCV
+        calibration_images = build_calibration_set(data_dir, img_size=img_size, diverse=diverse_calibration)
+        converter.representative_dataset = representative_dataset(calibration_images)
+    else:
+        # Already decoded float images in [0, 1] (e.g. from a sweep) skip the disk
+        def representative_dataset_gen():
+            for x in representative_images:
+                yield [np.asarray(x, dtype=np.float32)[np.newaxis]]
         
-        for class_name in os.listdir(train_dir):
-            class_path = os.path.join(train_dir, class_name)
-            print(f"Processing calibration images from class: {class_name}")
-            
-            for img_name in os.listdir(class_path)[:20]:  # Limit to 20 images per class for speed
-                img_path = os.path.join(class_path, img_name)
-                img = tf.keras.preprocessing.image.load_img(
-                    img_path, target_size=(96, 96)
-                )
-                x = tf.keras.preprocessing.image.img_to_array(img)
-                x = x / 255.0
-                x = tf.expand_dims(x, axis=0)
-                yield [x]
-    
-    converter.representative_dataset = representative_dataset_gen
+        converter.representative_dataset = representative_dataset_gen
     
     # Ensure the output directory exists
     os.makedirs(os.path.dirname(filename), exist_ok=True)
@@ -112,28 +116,65 @@ def prepare_dataset(data_dir, img_size=(96, 96), batch_size=32):
     # Return class names along with datasets
     return train_datagen, valid_datagen, class_names
 
-# Two-phase training
-if __name__ == "__main__":
-    # Use absolute path instead of relative path
-    PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    DATA_DIR = os.path.join(PROJECT_ROOT, "data")
-    MODEL_PATH = os.path.join(PROJECT_ROOT, "esp32", "model", "tomato_model.tflite")
-    
-    # Ensure model directory exists
-    os.makedirs(os.path.dirname(MODEL_PATH), exist_ok=True)
-    
-    print(f"Loading data from: {DATA_DIR}")
+def read_tfrecord_split(tfrecord_dir, split, batch_size=32, training=False, deterministic=False, seed=42):
+    """Batches of (image in [0, 1], label) from one split's TFRecord shards
+
+    Shards are read in parallel with interleave, so training streams a few
+    large files instead of opening every JPEG each epoch. With
+    deterministic=False, elements come from whichever shard is ready first.
+    """
+    with open(os.path.join(tfrecord_dir, 'metadata.json')) as f:
+        metadata = json.load(f)
+    image_shape = metadata['image_shape']
+    feature_spec = {
+        'image': tf.io.FixedLenFeature([], tf.string),
+        'label': tf.io.FixedLenFeature([], tf.int64),
+    }
     
-    # Modified to receive class_names
-    train_generator, valid_generator, class_names = prepare_dataset(DATA_DIR)
+    def parse_batch(serialized):
+        features = tf.io.parse_example(serialized, feature_spec)
+        images = tf.reshape(tf.io.decode_raw(features['image'], tf.uint8), [-1] + image_shape)
+        return tf.cast(images, tf.float32) / 255.0, tf.cast(features['label'], tf.int32)
     
-    # Use class_names from function return value
-    num_classes = len(class_names)
-    print(f"Detected {num_classes} classes: {class_names}")
+    files = tf.data.Dataset.list_files(
+        os.path.join(tfrecord_dir, f"{split}-*.tfrecord"), shuffle=training, seed=seed)
+    dataset = files.interleave(
+        lambda path: tf.data.TFRecordDataset(path, buffer_size=8 * 1024 * 1024),
+        num_parallel_calls=tf.data.AUTOTUNE,
+        deterministic=deterministic
+    )
+    if training:
+        # Shuffle the serialized records, which is cheaper than shuffling decoded
+        # images, over a buffer holding the whole split
+        buffer_size = metadata.get('counts', {}).get(split, 2048)
+        dataset = dataset.shuffle(max(buffer_size, 1), seed=seed if deterministic else None)
+    dataset = dataset.batch(batch_size)
+    dataset = dataset.map(parse_batch, num_parallel_calls=tf.data.AUTOTUNE, deterministic=deterministic)
     
-    # Create and train model
-    model = create_model(num_classes)
+    if training:
+        # Same augmentation as prepare_dataset
+        data_augmentation = tf.keras.Sequential([
+            tf.keras.layers.RandomFlip("horizontal"),
+            tf.keras.layers.RandomRotation(0.2),
+        ])
+        dataset = dataset.map(lambda x, y: (data_augmentation(x, training=True), y),
+                              num_parallel_calls=tf.data.AUTOTUNE, deterministic=deterministic)
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
+def prepare_tfrecord_dataset(tfrecord_dir, batch_size=32, deterministic=False):
+    """TFRecord counterpart of prepare_dataset for shards written by prepare_dataset.py --format tfrecord"""
+    with open(os.path.join(tfrecord_dir, 'metadata.json')) as f:
+        class_names = json.load(f)['classes']
+    print(f"Training classes: {class_names}")
     
+    train_data = read_tfrecord_split(tfrecord_dir, 'train', batch_size, training=True,
+                                     deterministic=deterministic)
+    valid_data = read_tfrecord_split(tfrecord_dir, 'validation', batch_size, training=False,
+                                     deterministic=deterministic)
+    return train_data, valid_data, class_names
+
+def train_two_phase(model, train_data, valid_data, epochs=10, fine_tune_epochs=10):
+    """Train the head on the frozen base, then fine-tune the last 20 base layers"""
     # Phase 1: Only the classification head is trainable (dense layers)
     # because base_model.trainable = False above
     model.compile(
@@ -143,7 +184,7 @@ if __name__ == "__main__":
     )
     
     # Training with FROZEN base model
-    model.fit(train_generator, epochs=10, validation_data=valid_generator)
+    model.fit(train_data, epochs=epochs, validation_data=valid_data)
     
     # Phase 2: Now we start the fine-tuning by unfreezing selectively
     base_model = model.layers[0]
@@ -162,11 +203,208 @@ if __name__ == "__main__":
     
     # Now train with the last 20 layers unfrozen
     history_fine = model.fit(
-        train_generator,
-        epochs=10,
-        validation_data=valid_generator,
+        train_data,
+        epochs=fine_tune_epochs,
+        validation_data=valid_data,
         callbacks=[tf.keras.callbacks.EarlyStopping(patience=5)]
     )
+    return history_fine
+
+def _rewrap(model, wrap):
+    """Apply a tfmot wrapper to the nested base model and the Dense head layers"""
+    layers = [wrap(model.layers[0])]
+    for layer in model.layers[1:]:
+        layers.append(wrap(layer) if isinstance(layer, tf.keras.layers.Dense) else layer)
+    return tf.keras.Sequential(layers)
+
+def compress_model(model, train_data, valid_data, prune=False, final_sparsity=0.5,
+                   cluster=False, number_of_clusters=16, recovery_epochs=2):
+    """Magnitude pruning and/or weight clustering followed by a recovery fine-tune
+
+    Returns the stripped (plain Keras) model, or the input model unchanged if
+    tensorflow_model_optimization is not installed.
+    """
+    try:
+        import tensorflow_model_optimization as tfmot
+    except ImportError:
+        print("tensorflow_model_optimization not installed. Skipping compression.")
+        print("To enable this feature, install with: pip install tensorflow-model-optimization")
+        return model
+    
+    def recover(compressed, callbacks=()):
+        compressed.compile(
+            optimizer=tf.keras.optimizers.Adam(1e-5),
+            loss='sparse_categorical_crossentropy',
+            metrics=['accuracy']
+        )
+        compressed.fit(train_data, epochs=recovery_epochs, validation_data=valid_data,
+                       callbacks=list(callbacks))
+    
+    if prune:
+        # Ramp sparsity from 0 to final_sparsity over the recovery fine-tune
+        steps_per_epoch = int(train_data.cardinality().numpy())
+        if steps_per_epoch < 0:
+            # Unknown length (e.g. TFRecord input): count the batches once
+            steps_per_epoch = sum(1 for _ in train_data)
+        end_step = steps_per_epoch * recovery_epochs
+        schedule = tfmot.sparsity.keras.PolynomialDecay(
+            initial_sparsity=0.0, final_sparsity=final_sparsity,
+            begin_step=0, end_step=max(end_step, 1))
+        print(f"Pruning to {final_sparsity:.0%} sparsity over {recovery_epochs} epochs...")
+        pruned = _rewrap(model, lambda layer: tfmot.sparsity.keras.prune_low_magnitude(
+            layer, pruning_schedule=schedule))
+        recover(pruned, [tfmot.sparsity.keras.UpdatePruningStep()])
+        model = tfmot.sparsity.keras.strip_pruning(pruned)
+    
+    if cluster:
+        print(f"Clustering weights into {number_of_clusters} centroids...")
+        params = {
+            'number_of_clusters': number_of_clusters,
+            'cluster_centroids_init': tfmot.clustering.keras.CentroidInitialization.KMEANS_PLUS_PLUS,
+        }
+        if prune:
+            # Keep the zeros from pruning when clustering the remaining weights
+            cluster_weights = tfmot.clustering.keras.experimental.cluster.cluster_weights
+            params['preserve_sparsity'] = True
+        else:
+            cluster_weights = tfmot.clustering.keras.cluster_weights
+        clustered = _rewrap(model, lambda layer: cluster_weights(layer, **params))
+        recover(clustered)
+        model = tfmot.clustering.keras.strip_clustering(clustered)
+    
+    return model
+
+def evaluate_tflite(filename, dataset, latency_runs=50):
+    """Accuracy on `dataset`, file size, gzipped size and host latency of a .tflite model"""
+    interpreter = tf.lite.Interpreter(model_path=filename)
+    interpreter.allocate_tensors()
+    input_details = interpreter.get_input_details()[0]
+    output_details = interpreter.get_output_details()[0]
+    scale, zero_point = input_details['quantization']
+    
+    def quantize(x):
+        if input_details['dtype'] == np.float32:
+            return x.astype(np.float32)
+        info = np.iinfo(input_details['dtype'])
+        return np.clip(np.round(x / scale + zero_point), info.min, info.max).astype(input_details['dtype'])
+    
+    correct = total = 0
+    for images, labels in dataset:
+        for image, label in zip(images.numpy(), labels.numpy()):
+            interpreter.set_tensor(input_details['index'], quantize(image[np.newaxis]))
+            interpreter.invoke()
+            output = interpreter.get_tensor(output_details['index'])
+            correct += int(np.argmax(output) == label)
+            total += 1
+    
+    # Single-image latency, median of latency_runs after a warm-up invoke
+    sample = np.zeros(input_details['shape'], dtype=input_details['dtype'])
+    interpreter.set_tensor(input_details['index'], sample)
+    interpreter.invoke()
+    timings = []
+    for _ in range(latency_runs):
+        start = time.perf_counter()
+        interpreter.invoke()
+        timings.append((time.perf_counter() - start) * 1000)
+    
+    with open(filename, 'rb') as f:
+        data = f.read()
+    return {
+        'accuracy': correct / max(total, 1),
+        'size_kb': round(len(data) / 1024, 1),
+        # Flash-image size once compressed, where pruned/clustered weights pay off
+        'gzip_size_kb': round(len(gzip.compress(data)) / 1024, 1),
+        'latency_ms': round(float(np.median(timings)), 3),
+    }
+
+def print_compression_report(before, after):
+    print("\nCompression report:")
+    print(f"{'metric':<16}{'before':>12}{'after':>12}{'change':>10}")
+    for metric in ('accuracy', 'size_kb', 'gzip_size_kb', 'latency_ms'):
+        change = (after[metric] - before[metric]) / before[metric] * 100 if before[metric] else 0.0
+        print(f"{metric:<16}{before[metric]:>12.3f}{after[metric]:>12.3f}{change:>+9.1f}%")
+
+# Two-phase training
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Train the ESP32 tomato disease model')
+    parser.add_argument('--img_size', type=int, default=96, help='Square model input size in pixels (default: 96)')
+    parser.add_argument('--alpha', type=float, default=0.35, help='MobileNetV2 width multiplier (default: 0.35)')
+    parser.add_argument('--prune', action='store_true', help='Apply magnitude pruning before conversion')
+    parser.add_argument('--final_sparsity', type=float, default=0.5,
+                        help='Fraction of weights pruned by the end of the schedule (default: 0.5)')
+    parser.add_argument('--cluster', action='store_true', help='Apply weight clustering before conversion')
+    parser.add_argument('--clusters', type=int, default=16, help='Number of weight clusters (default: 16)')
+    parser.add_argument('--recovery_epochs', type=int, default=2,
+                        help='Fine-tune epochs after each compression step (default: 2)')
+    parser.add_argument('--tfrecords', action='store_true',
+                        help='Train from the TFRecord shards in data/tfrecords (prepare_dataset.py --format tfrecord)')
+    parser.add_argument('--deterministic', action='store_true',
+                        help='Read TFRecord shards in a fixed order (slower, reproducible)')
+    parser.add_argument('--diverse_calibration', action='store_true',
+                        help='Pick int8 calibration images spread out by colour statistics')
+    args = parser.parse_args()
+    
+    # Use absolute path instead of relative path
+    PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    DATA_DIR = os.path.join(PROJECT_ROOT, "data")
+    MODEL_PATH = os.path.join(PROJECT_ROOT, "esp32", "model", "tomato_model.tflite")
+    
+    # Ensure model directory exists
+    os.makedirs(os.path.dirname(MODEL_PATH), exist_ok=True)
+    
+    print(f"Loading data from: {DATA_DIR}")
+    
+    # Modified to receive class_names
+    representative_images = None
+    input_shape = (args.img_size, args.img_size, 3)
+    if args.tfrecords:
+        tfrecord_dir = os.path.join(DATA_DIR, "tfrecords")
+        # The shards fix the input size
+        with open(os.path.join(tfrecord_dir, 'metadata.json')) as f:
+            input_shape = tuple(json.load(f)['image_shape'])
+        train_generator, valid_generator, class_names = prepare_tfrecord_dataset(
+            tfrecord_dir, deterministic=args.deterministic)
+        # No JPEG folders to calibrate from, so sample the train shards the same way
+        from calibration_set import build_record_calibration_set
+        representative_images = build_record_calibration_set(
+            tfrecord_dir, diverse=args.diverse_calibration).astype(np.float32) / 255.0
+    else:
+        train_generator, valid_generator, class_names = prepare_dataset(DATA_DIR, img_size=(args.img_size, args.img_size))
+    
+    # Use class_names from function return value
+    num_classes = len(class_names)
+    print(f"Detected {num_classes} classes: {class_names}")
+    
+    # Create and train model
+    model = create_model(num_classes, input_shape=input_shape, alpha=args.alpha)
+    
+    train_two_phase(model, train_generator, valid_generator)
+    
+    # Optional compression stage; keep an uncompressed export to compare against
+    compressing = args.prune or args.cluster
+    if compressing:
+        uncompressed_path = MODEL_PATH.replace('.tflite', '_uncompressed.tflite')
+        convert_to_tflite(model, uncompressed_path, DATA_DIR, representative_images=representative_images,
+                          diverse_calibration=args.diverse_calibration)
+        before = evaluate_tflite(uncompressed_path, valid_generator)
+        compressed = compress_model(
+            model, train_generator, valid_generator,
+            prune=args.prune, final_sparsity=args.final_sparsity,
+            cluster=args.cluster, number_of_clusters=args.clusters,
+            recovery_epochs=args.recovery_epochs
+        )
+        compressing = compressed is not model
+        model = compressed
     
     # Convert and save model - pass DATA_DIR to the function
-    convert_to_tflite(model, MODEL_PATH, DATA_DIR)
+    convert_to_tflite(model, MODEL_PATH, DATA_DIR, sparse=compressing and args.prune,
+                      representative_images=representative_images,
+                      diverse_calibration=args.diverse_calibration)
+    
+    if compressing:
+        after = evaluate_tflite(MODEL_PATH, valid_generator)
+        print_compression_report(before, after)
+        report_path = os.path.join(os.path.dirname(MODEL_PATH), "compression_report.json")
+        with open(report_path, 'w') as f:
+            json.dump({'before': before, 'after': after, 'settings': vars(args)}, f, indent=2)
+        print(f"Compression report saved to: {report_path}")
@@ -1,8 +1,13 @@
-import tensorflow as tf
 import numpy as np
 import os
 import json
 import datetime
+import shutil
+import sys
+import argparse
+
+# TensorFlow is imported inside the functions that need it so that importing
+# this module (e.g. from run_workflow.py) stays cheap
 
 def load_preprocessed_data(data_dir):
     """Load preprocessed numpy arrays"""
@@ -38,11 +43,14 @@ def load_preprocessed_data(data_dir):
     
     return np.array(images), np.array(labels), class_names
 
-def create_model(num_classes):
+def create_model(num_classes, input_shape=(96, 96, 3), alpha=1.0):
+    import tensorflow as tf
+    
     base_model = tf.keras.applications.MobileNetV2(  # Updated import
         weights='imagenet',
         include_top=False,
-        input_shape=(96, 96, 3)
+        input_shape=input_shape,
+        alpha=alpha
     )
     
     model = tf.keras.Sequential([
@@ -55,16 +63,20 @@ def create_model(num_classes):
     
     return model
 
-def preprocess_image(image_path):
+def preprocess_image(image_path, target_size=(96, 96)):
+    import tensorflow as tf
+    
     # Use tf.io instead of keras.preprocessing
     img = tf.io.read_file(image_path)
     img = tf.image.decode_image(img, channels=3)
-    img = tf.image.resize(img, [96, 96])
+    img = tf.image.resize(img, list(target_size))
     img = tf.cast(img, tf.float32) / 255.0
     return img
 
 def convert_to_tflite(model, output_path):
     """Convert model to TFLite format"""
+    import tensorflow as tf
+    
     # Create a converter using the SavedModel directory
     converter = tf.lite.TFLiteConverter.from_keras_model(model)
     
@@ -93,25 +105,68 @@ def save_for_web(model, output_dir):
         print("To enable this feature, install with: pip install tensorflowjs")
 
 def save_for_cloud(model, output_dir):
-    """Save model in SavedModel format for cloud deployment"""
+    """Save model in SavedModel format for cloud deployment
+    
+    Besides the default `serve` signature (float32 NHWC batches at the
+    model's input size) this
+    exports `serve_bytes`, which takes a batch of encoded image strings and
+    decodes, resizes and contrast-enhances them in the graph the same way
+    preprocess.preprocess_image does for training.
+    """
+    import tensorflow as tf
+    from graph_preprocess import preprocess_image_bytes
+    
+    input_shape = [None] + list(model.input_shape[1:])
+    target_size = tuple(input_shape[1:3])
+    
+    @tf.function(input_signature=[tf.TensorSpec(shape=[None], dtype=tf.string, name='image_bytes')])
+    def serve_bytes(image_bytes):
+        return model(preprocess_image_bytes(image_bytes, target_size), training=False)
+    
     try:
         os.makedirs(output_dir, exist_ok=True)
-        # Export model directly to the output directory
-        model.export(output_dir)
+        # Export both endpoints directly to the output directory
+        export_archive = tf.keras.export.ExportArchive()
+        export_archive.track(model)
+        export_archive.add_endpoint(
+            name="serve",
+            fn=model.call,
+            input_signature=[tf.TensorSpec(shape=input_shape, dtype=tf.float32)]
+        )
+        export_archive.add_endpoint(name="serve_bytes", fn=serve_bytes)
+        export_archive.write_out(output_dir)
         print(f"Model saved for cloud deployment to: {output_dir}")
     except Exception as e:
-        # Fallback to direct tf.saved_model.save if model.export fails
+        # Fallback to direct tf.saved_model.save if the export archive fails
         try:
-            tf.saved_model.save(model, output_dir)
+            serve = tf.function(
+                lambda x: model(x, training=False),
+                input_signature=[tf.TensorSpec(shape=input_shape, dtype=tf.float32)]
+            )
+            tf.saved_model.save(model, output_dir, signatures={
+                "serve": serve,
+                "serving_default": serve,
+                "serve_bytes": serve_bytes
+            })
             print(f"Model saved for cloud deployment to: {output_dir}")
         except Exception as inner_e:
             raise Exception(f"Failed to save model: {str(e)}, then failed fallback: {str(inner_e)}")
 
-if __name__ == "__main__":
+def main(argv=None):
+    """Command-line entry point, also importable by run_workflow.py"""
+    parser = argparse.ArgumentParser(description='Train the tomato disease model and export it for deployment')
+    parser.add_argument('--processed_dir', type=str,
+                        help='Custom preprocessed dataset directory (default: processed_dataset)')
+    parser.add_argument('--alpha', type=float, default=1.0,
+                        help='MobileNetV2 width multiplier (default: 1.0)')
+    args = parser.parse_args(argv)
+    
+    import tensorflow as tf
+    
     try:
         # Load preprocessed data
         PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
-        processed_dir = os.path.join(PROJECT_ROOT, "processed_dataset")
+        processed_dir = args.processed_dir if args.processed_dir else os.path.join(PROJECT_ROOT, "processed_dataset")
         print(f"Looking for processed data in: {processed_dir}")
         
         X, y, classes = load_preprocessed_data(processed_dir)
@@ -135,8 +190,8 @@ if __name__ == "__main__":
             X, y, test_size=0.2, random_state=42
         )
         
-        # Create and compile model
-        model = create_model(num_classes)
+        # Create and compile model; the input size follows the preprocessed data
+        model = create_model(num_classes, input_shape=X.shape[1:], alpha=args.alpha)
         model.compile(
             optimizer='adam',
             loss='categorical_crossentropy',
@@ -144,7 +199,7 @@ if __name__ == "__main__":
         )
         
         # Train model
-        history = model.fit(
+        model.fit(
             X_train, y_train,
             epochs=10,
             validation_data=(X_test, y_test),
@@ -171,6 +226,11 @@ if __name__ == "__main__":
             tflite_path = os.path.join(esp32_model_dir, "tomato_model.tflite")
             convert_to_tflite(model, tflite_path)
             print(f"- TFLite model saved to: {tflite_path}")
+            
+            # Ship the same export with the cloud function for its TFLite backend
+            cloud_tflite_path = os.path.join(cloud_model_dir, "tomato_model.tflite")
+            shutil.copyfile(tflite_path, cloud_tflite_path)
+            print(f"- TFLite model copied to: {cloud_tflite_path}")
         except Exception as e:
             print(f"Error saving TFLite model: {str(e)}")
         
@@ -192,7 +252,8 @@ if __name__ == "__main__":
         try:
             class_info = {
                 "classes": classes,
-                "input_shape": [96, 96, 3],
+                "input_shape": list(X.shape[1:]),
+                "alpha": args.alpha,
                 "version": "1.0",
                 "date_trained": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             }
@@ -212,4 +273,8 @@ if __name__ == "__main__":
         print("1. You have run preprocess.py first")
         print("2. You have images in your raw_dataset folder")
         print("3. The processed_dataset folder exists and contains .npy files")
-        exit(1)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())